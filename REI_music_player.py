@@ -1,9 +1,33 @@
+import time
+
+# Everything after this line counts as "imports" in --profile-startup.
+MODULE_STARTED = time.perf_counter()
+
+import argparse
+import array
+import collections
+import contextlib
+import bisect
+import concurrent.futures
+import ctypes
+import ctypes.util
+import heapq
+import json
+import mmap
+import multiprocessing
 import tkinter as tk
 from tkinter import messagebox
 import os
 import math
+import queue
 import random
-import time
+import select
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import importlib
 from pathlib import Path
 
 try:
@@ -12,19 +36,47 @@ except Exception:
     os.system("pip install pillow")
     from PIL import Image, ImageDraw, ImageTk, ImageSequence
 
-try:
-    import pygame
-    pygame.mixer.init()
-except Exception:
-    os.system("pip install pygame")
-    import pygame
-    pygame.mixer.init()
+
+
+class LazyModule:
+    # Stands in for a heavy module until the first attribute access, so the window can show before it loads.
+    def __init__(self, name, package=None, on_load=None):
+        self._name = name
+        self._package = package or name.split('.')[0]
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is None:
+                try:
+                    module = importlib.import_module(self._name)
+                except ImportError:
+                    os.system(f"pip install {self._package}")
+                    module = importlib.import_module(self._name)
+                if self._on_load is not None:
+                    self._on_load(module)
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+pygame = LazyModule('pygame', on_load=lambda module: module.mixer.init())
+mutagen_mp3 = LazyModule('mutagen.mp3', package='mutagen')
+mutagen_apev2 = LazyModule('mutagen.apev2', package='mutagen')
 
 try:
-    from mutagen.mp3 import MP3
+    import numpy as np
 except Exception:
-    os.system("pip install mutagen")
-    from mutagen.mp3 import MP3
+    np = None
 
 
 LIGHT_THEME = {
@@ -37,7 +89,8 @@ LIGHT_THEME = {
     'text': '#1e3a8a',
     'grass': '#8ecae6',
     'slider_trough': '#c7d2fe',
-    'slider_active': '#3b82f6'
+    'slider_active': '#3b82f6',
+    'waveform': '#b4c8f5'
 }
 
 DARK_THEME = {
@@ -50,7 +103,8 @@ DARK_THEME = {
     'text': '#e2efff',
     'grass': '#18486a',
     'slider_trough': '#1f2f4a',
-    'slider_active': '#60a5fa'
+    'slider_active': '#60a5fa',
+    'waveform': '#1b3a5e'
 }
 
 COLORS = dict(LIGHT_THEME)
@@ -59,6 +113,35 @@ CANVAS_SIZE = (240, 306)
 GRASS_HEIGHT = 0
 TAU = math.pi * 2.0
 
+MUSIC_DIR = Path(__file__).parent / 'music'
+CACHE_DIR = Path(__file__).parent / '.cache'
+LIBRARY_INDEX_PATH = CACHE_DIR / 'library.sqlite3'
+ASSET_CACHE_DIR = CACHE_DIR / 'assets'
+
+UI_SPRITES = (
+    ('play_img', 'assets', 'blueresume-removebg-preview.png', (68, 68)),
+    ('pause_img', 'assets', 'bluepause-removebg-preview.png', (68, 68)),
+    ('back_img', 'assets', 'leftarrow-removebg-preview.png', (44, 44)),
+    ('next_img', 'assets', 'rightarrow-removebg-preview.png', (44, 44)),
+    ('vol_on_img', 'assets', 'volumeon-removebg-preview.png', (40, 40)),
+    ('vol_off_img', 'assets', 'volumeoff-removebg-preview.png', (40, 40)),
+    ('vol_knob_img', 'deco', 'pixelreiheart-removebg-preview.png', (44, 44)),
+    ('progress_deco_img', 'deco', 'shinjipixelchair-removebg-preview.png', (64, 64)),
+    ('progress_knob_img', 'deco', 'reidrag-removebg-preview.png', (40, 40)),
+    ('light_mode_icon', 'deco', 'lightmodestars-removebg-preview.png', (32, 32)),
+    ('dark_mode_icon', 'deco', 'darkmodemoon-removebg-preview.png', (32, 32))
+)
+GAPLESS_QUEUE_LEAD = 15.0
+WAVEFORM_BUCKETS = 1024
+WAVEFORM_RATE = 11025
+# ReplayGain 2 reference level, in LUFS.
+LOUDNESS_TARGET = -18.0
+LOUDNESS_RATE = 22050
+
+
+def music_end_event():
+    return pygame.USEREVENT + 1
+
 
 def hex_to_rgb(value):
     value = value.lstrip('#')
@@ -70,24 +153,153 @@ def rgb_to_hex(rgb):
     return f"#{r:02x}{g:02x}{b:02x}"
 
 
+GRADIENT_CACHE_SIZE = 8
+_gradient_cache = collections.OrderedDict()
+
+
+def vertical_gradient(size, top_hex, bottom_hex):
+    key = (tuple(size), top_hex, bottom_hex)
+    img = _gradient_cache.get(key)
+    if img is not None:
+        _gradient_cache.move_to_end(key)
+        return img
+    w, h = size
+    top = hex_to_rgb(top_hex)
+    bottom = hex_to_rgb(bottom_hex)
+    # Build a single 1px column and stretch it; the per-row colours match the old draw.line loop exactly.
+    if np is not None:
+        ratio = np.arange(h, dtype=np.float64)[:, None] / max(1, h - 1)
+        column = np.empty((h, 1, 4), dtype=np.uint8)
+        column[:, 0, :3] = (np.array(top) * (1 - ratio) + np.array(bottom) * ratio).astype(np.uint8)
+        column[:, 0, 3] = 255
+        strip = Image.fromarray(column, 'RGBA')
+    else:
+        rows = bytearray()
+        for y in range(h):
+            ratio = y / max(1, h - 1)
+            rows.extend(int(top[i] * (1 - ratio) + bottom[i] * ratio) for i in range(3))
+            rows.append(255)
+        strip = Image.frombytes('RGBA', (1, h), bytes(rows))
+    img = strip.resize((w, h), Image.Resampling.NEAREST)
+    _gradient_cache[key] = img
+    while len(_gradient_cache) > GRADIENT_CACHE_SIZE:
+        _gradient_cache.popitem(last=False)
+    return img
+
+
+def load_sprite(path, size):
+    try:
+        img = Image.open(path).convert('RGBA')
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        return img
+    except Exception:
+        return None
+
+
+class AssetAtlas:
+    VERSION = 1
+    PADDING = 1
+
+    def __init__(self, specs=UI_SPRITES, root=Path(__file__).parent, cache_dir=ASSET_CACHE_DIR):
+        self.specs = specs
+        self.root = Path(root)
+        self.cache_dir = Path(cache_dir)
+        self.atlas_path = self.cache_dir / 'atlas.png'
+        self.manifest_path = self.cache_dir / 'manifest.json'
+        self.last_load = None
+
+    def _sources(self):
+        sources = {}
+        for key, folder, filename, size in self.specs:
+            path = self.root / folder / filename
+            try:
+                mtime_ns = path.stat().st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            sources[key] = {'source': f'{folder}/{filename}', 'mtime_ns': mtime_ns, 'size': list(size)}
+        return sources
+
+    def load(self):
+        sources = self._sources()
+        sprites = self._read(sources)
+        if sprites is None:
+            self.last_load = 'built'
+            return self.build(sources)
+        self.last_load = 'cached'
+        return sprites
+
+    def _read(self, sources):
+        try:
+            manifest = json.loads(self.manifest_path.read_text())
+        except (OSError, ValueError):
+            return None
+        entries = manifest.get('sprites', {})
+        if manifest.get('version') != self.VERSION or set(entries) != set(sources):
+            return None
+        for key, source in sources.items():
+            entry = entries[key]
+            if any(entry.get(name) != source[name] for name in ('source', 'mtime_ns', 'size')):
+                return None
+        try:
+            with Image.open(self.atlas_path) as atlas:
+                atlas = atlas.convert('RGBA')
+        except Exception:
+            return None
+        sprites = {}
+        for key, entry in entries.items():
+            box = entry.get('box')
+            if box is None:
+                sprites[key] = None
+                continue
+            x, y, w, h = box
+            sprites[key] = atlas.crop((x, y, x + w, y + h))
+        return sprites
+
+    def build(self, sources=None):
+        sources = sources or self._sources()
+        sprites = {}
+        for key, folder, filename, size in self.specs:
+            sprites[key] = load_sprite(self.root / folder / filename, size) if sources[key]['mtime_ns'] is not None else None
+        # Shelf packing, tallest first: plenty for a dozen icons and keeps the atlas narrow.
+        placed = sorted((key for key in sprites if sprites[key] is not None), key=lambda key: -sprites[key].height)
+        width = max([sprites[key].width for key in placed] + [256])
+        boxes = {}
+        x = y = shelf = 0
+        for key in placed:
+            img = sprites[key]
+            if x and x + img.width > width:
+                x = 0
+                y += shelf + self.PADDING
+                shelf = 0
+            boxes[key] = [x, y, img.width, img.height]
+            x += img.width + self.PADDING
+            shelf = max(shelf, img.height)
+        atlas = Image.new('RGBA', (width, max(1, y + shelf)), (0, 0, 0, 0))
+        for key in placed:
+            atlas.paste(sprites[key], tuple(boxes[key][:2]))
+        manifest = {'version': self.VERSION, 'sprites': {}}
+        for key, source in sources.items():
+            entry = dict(source)
+            entry['box'] = boxes.get(key)
+            manifest['sprites'][key] = entry
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            scratch = self.atlas_path.with_suffix('.tmp.png')
+            atlas.save(scratch)
+            os.replace(scratch, self.atlas_path)
+            self.manifest_path.write_text(json.dumps(manifest, indent=1))
+        except OSError:
+            pass
+        return sprites
+
+
 class SakuraBackground:
     def __init__(self, size):
         self.size = size
         self.base = self._build_base()
 
     def _build_base(self):
-        w, h = self.size
-        img = Image.new('RGBA', (w, h))
-        draw = ImageDraw.Draw(img)
-        top = hex_to_rgb(COLORS['bg_top'])
-        bottom = hex_to_rgb(COLORS['bg_bottom'])
-        for y in range(h):
-            ratio = y / max(1, h - 1)
-            r = int(top[0] * (1 - ratio) + bottom[0] * ratio)
-            g = int(top[1] * (1 - ratio) + bottom[1] * ratio)
-            b = int(top[2] * (1 - ratio) + bottom[2] * ratio)
-            draw.line([(0, y), (w, y)], fill=(r, g, b, 255))
-        return img
+        return vertical_gradient(self.size, COLORS['bg_top'], COLORS['bg_bottom'])
 
     def render(self, t):
         frame = self.base.copy()
@@ -161,32 +373,131 @@ class SakuraPetalField:
         return img
 
 
+class SakuraPetalArrays:
+    QUAD_DX = (-0.6, 0.0, 0.6, 0.0)
+    QUAD_DY = (0.0, -1.0, 0.0, 1.0)
+
+    def __init__(self, size, count=28, seed=None):
+        self.w, self.h = size
+        self.time = 0.0
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+        self.x = np.empty(count)
+        self.y = np.empty(count)
+        self.vx = np.empty(count)
+        self.vy = np.empty(count)
+        self.size = np.empty(count)
+        self.angle = np.empty(count)
+        self.spin = np.empty(count)
+        self.phase = np.empty(count)
+        self.drift = np.empty(count)
+        self.wave_speed = np.empty(count)
+        self.colors = np.empty((count, 4), dtype=np.uint8)
+        self._dx = np.array(self.QUAD_DX)
+        self._dy = np.array(self.QUAD_DY)
+        everyone = np.arange(count)
+        self._spawn(everyone, self.rng.uniform(-self.h, self.h * 0.3, count))
+
+    def _spawn(self, index, start_y=None):
+        n = len(index)
+        rng = self.rng
+        self.y[index] = start_y if start_y is not None else rng.uniform(-self.h, -10, n)
+        self.x[index] = rng.uniform(0, self.w, n)
+        self.vx[index] = rng.uniform(-22, 22, n)
+        self.vy[index] = rng.uniform(35, 60, n)
+        self.size[index] = rng.uniform(8, 14, n)
+        self.angle[index] = rng.uniform(0, TAU, n)
+        self.spin[index] = rng.uniform(-1.6, 1.6, n)
+        self.phase[index] = rng.uniform(0, TAU, n)
+        self.drift[index] = rng.uniform(0.6, 1.6, n)
+        self.wave_speed[index] = rng.uniform(0.6, 1.1, n)
+        shade = rng.integers(-20, 26, n)
+        self.colors[index, 0] = 255
+        self.colors[index, 1] = np.clip(200 + shade, 150, 255)
+        self.colors[index, 2] = np.clip(220 + shade, 170, 255)
+        self.colors[index, 3] = 200
+        self._color_list = None
+
+    def step(self, dt):
+        self.time += dt
+        self.x += (self.vx + np.sin(self.time * self.wave_speed + self.phase) * self.drift) * dt
+        self.y += self.vy * dt
+        self.angle += self.spin * dt
+        fallen = self.y > self.h + 20
+        stray = ~fallen & ((self.x < -15) | (self.x > self.w + 15))
+        if stray.any():
+            self.x[stray] %= (self.w + 15)
+        if fallen.any():
+            self._spawn(np.flatnonzero(fallen))
+
+    def quads(self):
+        cos_a = np.cos(self.angle)[:, None]
+        sin_a = np.sin(self.angle)[:, None]
+        dx = self._dx * self.size[:, None]
+        dy = self._dy * self.size[:, None]
+        quads = np.empty((self.count, 8))
+        quads[:, 0::2] = self.x[:, None] + dx * cos_a - dy * sin_a
+        quads[:, 1::2] = self.y[:, None] + dx * sin_a + dy * cos_a
+        return quads
+
+    def render(self):
+        img = Image.new('RGBA', (self.w, self.h), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img, 'RGBA')
+        if self._color_list is None:
+            self._color_list = [tuple(color) for color in self.colors.tolist()]
+        quads = self.quads()
+        reach = self.size
+        visible = np.flatnonzero(
+            (self.y + reach >= 0) & (self.y - reach < self.h) & (self.x + reach >= 0) & (self.x - reach < self.w)
+        )
+        colors = self._color_list
+        polygon = draw.polygon
+        for index, quad in zip(visible.tolist(), quads[visible].tolist()):
+            polygon(quad, fill=colors[index])
+        return img
+
+
+def make_petal_field(size, count=28):
+    if np is not None:
+        return SakuraPetalArrays(size, count)
+    return SakuraPetalField(size, count)
+
+
 class GrassField:
-    def __init__(self, w, h, blades=72):
+    def __init__(self, w, h, blades=72, period=30.0, max_frames=360, max_bytes=24 * 1024 * 1024, blend=False):
         self.w = w
         self.h = h
         self.base_w = max(80, w // 3)
         self.base_h = max(40, h // 2)
-        base_rgb = hex_to_rgb(COLORS['grass'])
+        # Every blade sways a whole number of times per period, so the field repeats exactly and a
+        # ring of pre-rendered frames can stand in for per-call drawing.
+        self.period = float(period)
+        self.frame_count = max(1, min(int(max_frames), int(max_bytes) // max(1, w * h * 4)))
+        self.blend = blend
+        self.frames = [None] * self.frame_count
+        self.stats = {'hits': 0, 'renders': 0, 'invalidations': 0}
+        self.grass_hex = COLORS['grass']
+        base_rgb = hex_to_rgb(self.grass_hex)
         self.base_color = (base_rgb[0], base_rgb[1], base_rgb[2], 245)
         self.blades = []
         for _ in range(blades):
             base_x = random.uniform(0, self.base_w - 1)
             height = random.uniform(self.base_h * 0.45, self.base_h * 0.95)
+            cycles = max(1, round(random.uniform(0.35, 0.65) * self.period / TAU))
             blade = {
                 'x': base_x,
                 'height': height,
                 'width': random.uniform(0.9, 1.8),
                 'amp': random.uniform(0.3, 1.1),
-                'speed': random.uniform(0.35, 0.65),
+                'speed': cycles * TAU / self.period,
                 'phase': random.uniform(0, TAU),
-                'color': self._shade_color()
+                'shade': random.randint(-18, 18)
             }
+            blade['color'] = self._shade_color(blade['shade'])
             self.blades.append(blade)
 
-    def _shade_color(self):
+    def _shade_color(self, delta):
         base_rgb = hex_to_rgb(COLORS['grass'])
-        delta = random.randint(-18, 18)
         return (
             max(0, min(255, base_rgb[0] + delta)),
             max(0, min(255, base_rgb[1] + delta)),
@@ -194,7 +505,41 @@ class GrassField:
             235
         )
 
+    def _check_theme(self):
+        if COLORS['grass'] == self.grass_hex:
+            return
+        self.grass_hex = COLORS['grass']
+        base_rgb = hex_to_rgb(self.grass_hex)
+        self.base_color = (base_rgb[0], base_rgb[1], base_rgb[2], 245)
+        for blade in self.blades:
+            blade['color'] = self._shade_color(blade['shade'])
+        self.frames = [None] * self.frame_count
+        self.stats['invalidations'] += 1
+
+    def _frame(self, slot):
+        frame = self.frames[slot]
+        if frame is None:
+            frame = self._render_frame(slot * self.period / self.frame_count)
+            self.frames[slot] = frame
+            self.stats['renders'] += 1
+        else:
+            self.stats['hits'] += 1
+        return frame
+
+    def cache_bytes(self):
+        return sum(frame.width * frame.height * 4 for frame in self.frames if frame is not None)
+
     def generate_frame(self, t):
+        self._check_theme()
+        position = (t % self.period) / self.period * self.frame_count
+        slot = int(position) % self.frame_count
+        frame = self._frame(slot)
+        fraction = position - int(position)
+        if self.blend and fraction > 0.05:
+            return Image.blend(frame, self._frame((slot + 1) % self.frame_count), fraction)
+        return frame
+
+    def _render_frame(self, t):
         base = Image.new('RGBA', (self.base_w, self.base_h), (0, 0, 0, 0))
         draw = ImageDraw.Draw(base, 'RGBA')
         ground = self.base_h - 1
@@ -224,6 +569,13 @@ class DecoManager:
         self.scale = canvas_size[0] / 320.0
         self.items = []
         self._load_items()
+        self.items.sort(key=lambda data: data['layer'])
+        self.canvas = None
+        self.base = None
+        self.live = []
+        self.version = 0
+        self.last_frame = {'sprites': 0, 'pixels': 0, 'rects': 0}
+        self.totals = {'frames': 0, 'sprites': 0, 'pixels': 0}
 
     def _load_items(self):
         w, _ = self.canvas_size
@@ -271,16 +623,102 @@ class DecoManager:
         except Exception:
             return None
 
-    def render(self, t):
-        layer = Image.new('RGBA', self.canvas_size, (0, 0, 0, 0))
-        for item in sorted(self.items, key=lambda data: data['layer']):
+    def _moves(self, item):
+        return bool(item.get('bob', 0.0) and item.get('speed', 0.0))
+
+    def _topleft(self, item, t):
+        offset = 0.0
+        if self._moves(item):
+            offset = math.sin(t * item['speed'] + item['phase']) * item['bob']
+        return self._anchor_to_topleft(item['image'].size, item.get('anchor', 'center'), item['pos'], offset)
+
+    def _bake(self, t):
+        # Sprites drawn before the first moving one never need redrawing, so they live in a
+        # static base; everything from the first moving sprite upwards is kept "live".
+        self.base = Image.new('RGBA', self.canvas_size, (0, 0, 0, 0))
+        self.live = []
+        for item in self.items:
+            if self.live or self._moves(item):
+                self.live.append(item)
+            else:
+                img = item['image']
+                self.base.paste(img, self._topleft(item, t), img)
+        self.canvas = self.base.copy()
+        for item in self.live:
             img = item['image']
-            offset = 0.0
-            if item.get('bob', 0.0) and item.get('speed', 0.0):
-                offset = math.sin(t * item['speed'] + item['phase']) * item['bob']
-            left, top = self._anchor_to_topleft(img.size, item.get('anchor', 'center'), item['pos'], offset)
-            layer.paste(img, (left, top), img)
-        return layer
+            item['_drawn_at'] = self._topleft(item, t)
+            self.canvas.paste(img, item['_drawn_at'], img)
+        self.version += 1
+
+    def invalidate(self):
+        self.canvas = None
+
+    def render(self, t):
+        if self.canvas is None:
+            self._bake(t)
+            self.last_frame = {'sprites': len(self.items), 'pixels': self.canvas_size[0] * self.canvas_size[1], 'rects': 1}
+            self._count_frame()
+            return self.canvas
+        rects = []
+        for item in self.live:
+            if not self._moves(item):
+                continue
+            position = self._topleft(item, t)
+            previous = item['_drawn_at']
+            if position == previous:
+                continue
+            item['_drawn_at'] = position
+            w, h = item['image'].size
+            rect = (
+                min(position[0], previous[0]),
+                min(position[1], previous[1]),
+                max(position[0], previous[0]) + w,
+                max(position[1], previous[1]) + h
+            )
+            rect = self._clip(rect)
+            if rect is not None:
+                rects.append(rect)
+        sprites = 0
+        pixels = 0
+        for rect in rects:
+            # Each rect is rebuilt from scratch (base, then every live sprite clipped to it), so
+            # overlapping rects stay correct without merging.
+            self.canvas.paste(self.base.crop(rect), rect[:2])
+            pixels += (rect[2] - rect[0]) * (rect[3] - rect[1])
+            for item in self.live:
+                img = item['image']
+                left, top = item['_drawn_at']
+                overlap = self._clip((
+                    max(rect[0], left),
+                    max(rect[1], top),
+                    min(rect[2], left + img.width),
+                    min(rect[3], top + img.height)
+                ))
+                if overlap is None:
+                    continue
+                piece = img.crop((overlap[0] - left, overlap[1] - top, overlap[2] - left, overlap[3] - top))
+                self.canvas.paste(piece, overlap[:2], piece)
+                sprites += 1
+        if rects:
+            self.version += 1
+        self.last_frame = {'sprites': sprites, 'pixels': pixels, 'rects': len(rects)}
+        self._count_frame()
+        return self.canvas
+
+    def _count_frame(self):
+        self.totals['frames'] += 1
+        self.totals['sprites'] += self.last_frame['sprites']
+        self.totals['pixels'] += self.last_frame['pixels']
+
+    def _clip(self, rect):
+        w, h = self.canvas_size
+        left = max(0, rect[0])
+        top = max(0, rect[1])
+        right = min(w, rect[2])
+        bottom = min(h, rect[3])
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, right, bottom)
 
     def _anchor_to_topleft(self, size, anchor, position, offset_y):
         anchor = (anchor or 'center').lower()
@@ -302,7 +740,169 @@ class DecoManager:
         return int(round(left)), int(round(top))
 
 
+class ImageCache:
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+        img = loader()
+        if img is not None:
+            with self.lock:
+                self.entries[key] = img
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return img
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+scene_image_cache = ImageCache()
+
+
+class RollingHistogram:
+    def __init__(self, window=512):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, fraction, ordered=None):
+        ordered = ordered if ordered is not None else sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction * (len(ordered) - 1) + 0.5))]
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(0.50, ordered),
+            'p95_ms': self.percentile(0.95, ordered),
+            'p99_ms': self.percentile(0.99, ordered)
+        }
+
+
+class StageTimer:
+    __slots__ = ('owner', 'stage', 'started')
+
+    def __init__(self, owner, stage):
+        self.owner = owner
+        self.stage = stage
+        self.started = None
+
+    def __enter__(self):
+        self.started = self.owner.clock()
+        return self
+
+    def __exit__(self, *_exc):
+        self.owner.record(self.stage, self.owner.clock() - self.started)
+        return False
+
+
+class Instrumentation:
+    # Off by default: record/count/timer return straight away until enable() is called.
+    def __init__(self, window=512, clock=time.perf_counter):
+        self.enabled = False
+        self.window = window
+        self.clock = clock
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.sources = {}
+        self.lock = threading.Lock()
+        self.log = None
+        self._idle = contextlib.nullcontext()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = RollingHistogram(self.window)
+            histogram.add(seconds * 1000.0)
+
+    def timer(self, stage):
+        if not self.enabled:
+            return self._idle
+        return StageTimer(self, stage)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += amount
+
+    def add_source(self, name, source):
+        self.sources[name] = source
+
+    def snapshot(self):
+        with self.lock:
+            stages = {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+        sources = {}
+        for name, source in self.sources.items():
+            try:
+                sources[name] = source()
+            except Exception:
+                sources[name] = None
+        return {'time': time.time(), 'stages': stages, 'counters': counters, 'sources': sources}
+
+    def open_log(self, path):
+        self.close_log()
+        self.log = open(path, 'a', buffering=1)
+        self.enable()
+
+    def write_log(self, snapshot=None):
+        if self.log is None:
+            return
+        try:
+            self.log.write(json.dumps(snapshot or self.snapshot(), default=str) + '\n')
+        except (OSError, ValueError):
+            pass
+
+    def close_log(self):
+        if self.log is not None:
+            try:
+                self.log.close()
+            except OSError:
+                pass
+            self.log = None
+
+
+instruments = Instrumentation()
+
+
 class SakuraScene:
+    BORDER_COLOR = '#1e3a8a'
+
     def __init__(self, canvas_size):
         self.size = canvas_size
         self.time = 0.0
@@ -318,28 +918,34 @@ class SakuraScene:
         deco_path = Path(__file__).parent / 'deco'
         for name in ('bigpixelrei.png', 'bigpixelrei.jpg'):
             candidate = deco_path / name
-            if not candidate.exists():
+            try:
+                mtime_ns = candidate.stat().st_mtime_ns
+            except OSError:
                 continue
+            border_width = max(2, int(min(self.size) * 0.012))
+            key = (str(candidate), mtime_ns, tuple(self.size), self.BORDER_COLOR, border_width)
+            return scene_image_cache.get(key, lambda: self._decode_scene_image(candidate, border_width))
+        return None
+
+    def _decode_scene_image(self, candidate, border_width):
+        try:
+            img = Image.open(candidate).convert('RGBA')
+            if img.size != self.size:
+                img = img.resize(self.size, Image.Resampling.LANCZOS)
             try:
-                img = Image.open(candidate).convert('RGBA')
-                if img.size != self.size:
-                    img = img.resize(self.size, Image.Resampling.LANCZOS)
-                try:
-                    border_rgb = hex_to_rgb('#1e3a8a')
-                    border_rgba = (border_rgb[0], border_rgb[1], border_rgb[2], 255)
-                    border_width = max(2, int(min(img.size) * 0.012))
-                    draw = ImageDraw.Draw(img)
-                    for offset in range(border_width):
-                        draw.rectangle(
-                            [offset, offset, img.width - 1 - offset, img.height - 1 - offset],
-                            outline=border_rgba
-                        )
-                except Exception:
-                    pass
-                return img
+                border_rgb = hex_to_rgb(self.BORDER_COLOR)
+                border_rgba = (border_rgb[0], border_rgb[1], border_rgb[2], 255)
+                draw = ImageDraw.Draw(img)
+                for offset in range(border_width):
+                    draw.rectangle(
+                        [offset, offset, img.width - 1 - offset, img.height - 1 - offset],
+                        outline=border_rgba
+                    )
             except Exception:
-                return None
-        return None
+                pass
+            return img
+        except Exception:
+            return None
 
 
 class BlueScale(tk.Canvas):
@@ -362,6 +968,8 @@ class BlueScale(tk.Canvas):
         knob_offset=0.0,
         trough_height=6,
         extra_top=0.0,
+        waveform_color=None,
+        waveform_height=0,
         **kwargs
     ):
         bg = COLORS['bg'] if bg is None else bg
@@ -376,6 +984,7 @@ class BlueScale(tk.Canvas):
         self.knob_color = knob_color or COLORS['dark']
         self.active_color = active_color or COLORS['active']
         self.knob_image = knob_image
+        self.outline_color = COLORS['text']
         self.knob_offset = float(knob_offset)
         self.extra_top = max(0.0, float(extra_top))
         if knob_width is None:
@@ -391,6 +1000,9 @@ class BlueScale(tk.Canvas):
         self.knob_width = float(knob_width)
         self.knob_height = float(knob_height)
         self.trough_height = float(trough_height)
+        self.waveform_color = waveform_color or COLORS['waveform']
+        self.waveform_height = float(waveform_height)
+        self.peaks = None
         self._suppress_trace = False
         self._dragging = False
         self._active_state = False
@@ -403,6 +1015,8 @@ class BlueScale(tk.Canvas):
         self.configure(width=canvas_width, height=canvas_height)
         self._center_y = self._compute_center(canvas_height)
 
+        # Created first so it stays underneath the trough and knob.
+        self.waveform_id = self.create_polygon(0, 0, 0, 0, 0, 0, fill=self.waveform_color, outline='', state='hidden')
         self.trough_id = self.create_rectangle(0, 0, 0, 0, fill=self.trough_color, outline=self.trough_color, width=0)
         self.knob_outline_id = None
         if self.knob_image:
@@ -410,7 +1024,7 @@ class BlueScale(tk.Canvas):
             self.knob_highlight_id = None
         else:
             self.knob_id = self.create_oval(0, 0, 0, 0, fill=self.knob_color, outline='', width=0)
-            self.knob_outline_id = self.create_oval(0, 0, 0, 0, outline=COLORS['text'], width=1)
+            self.knob_outline_id = self.create_oval(0, 0, 0, 0, outline=self.outline_color, width=1)
             self.knob_highlight_id = None
 
         self.bind('<Configure>', self._on_resize)
@@ -492,6 +1106,34 @@ class BlueScale(tk.Canvas):
         top = self._center_y - self.trough_height / 2.0
         bottom = self._center_y + self.trough_height / 2.0
         self.coords(self.trough_id, start, top, end, bottom)
+        self._update_waveform()
+
+    def set_peaks(self, peaks):
+        if peaks == self.peaks:
+            return
+        self.peaks = peaks
+        self._update_waveform()
+
+    def _update_waveform(self):
+        columns = waveform_columns(self.peaks, int(self.length)) if self.peaks and self.waveform_height > 0 else []
+        if not columns:
+            self.itemconfigure(self.waveform_id, state='hidden')
+            return
+        # Centred on the trough where there is room, otherwise pushed down to stay on the canvas.
+        half = self.waveform_height / 2.0
+        middle = max(self._center_y, half)
+        step = self.length / len(columns)
+        start = self._margin
+        upper = []
+        lower = []
+        for column, (low, high) in enumerate(columns):
+            x = start + column * step
+            upper.extend((x, middle - high * half, x + step, middle - high * half))
+            lower.extend((x + step, middle - low * half, x, middle - low * half))
+        for column in range(len(lower) - 4, -1, -4):
+            upper.extend(lower[column:column + 4])
+        self.coords(self.waveform_id, *upper)
+        self.itemconfigure(self.waveform_id, state='normal')
 
     def _update_knob(self, value):
         self._suppress_trace = True
@@ -548,28 +1190,44 @@ class BlueScale(tk.Canvas):
         except Exception:
             return self.from_
 
-    def apply_theme(self, *, bg=None, trough=None, knob=None, active=None, outline=None):
-        if bg is not None:
+    def apply_theme(self, *, bg=None, trough=None, knob=None, active=None, outline=None, waveform=None):
+        calls = 0
+        if waveform is not None and waveform != self.waveform_color:
+            self.waveform_color = waveform
+            self.itemconfigure(self.waveform_id, fill=waveform)
+            calls += 1
+        if bg is not None and bg != self.bg_color:
             self.bg_color = bg
             self.configure(bg=bg)
-        if trough is not None:
+            calls += 1
+        if trough is not None and trough != self.trough_color:
             self.trough_color = trough
             self.itemconfigure(self.trough_id, fill=trough, outline=trough)
+            calls += 1
         if not self.knob_image:
-            if knob is not None:
+            if knob is not None and knob != self.knob_color:
                 self.knob_color = knob
                 if not self._active_state and self.knob_id:
                     self.itemconfigure(self.knob_id, fill=knob)
-            if active is not None:
+                    calls += 1
+            if active is not None and active != self.active_color:
                 self.active_color = active
                 if self._active_state and self.knob_id:
                     self.itemconfigure(self.knob_id, fill=active)
+                    calls += 1
         if self.knob_outline_id:
             outline_color = outline or COLORS['text']
-            self.itemconfigure(self.knob_outline_id, outline=outline_color)
-        self.tag_raise(self.knob_id)
-        if self.knob_outline_id:
-            self.tag_raise(self.knob_outline_id)
+            if outline_color != self.outline_color:
+                self.outline_color = outline_color
+                self.itemconfigure(self.knob_outline_id, outline=outline_color)
+                calls += 1
+        if calls:
+            self.tag_raise(self.knob_id)
+            calls += 1
+            if self.knob_outline_id:
+                self.tag_raise(self.knob_outline_id)
+                calls += 1
+        return calls
 
     def __getitem__(self, key):
         if key == 'from':
@@ -590,139 +1248,3072 @@ class BlueScale(tk.Canvas):
         return super().cget(option)
 
 
-class MiffyPlayer:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("REI Music Player")
-        self.theme = 'light'
-        self.light_mode_icon = None
-        self.dark_mode_icon = None
-        self.theme_button = None
-        self.bg_widgets = []
-        self.text_widgets = []
-        self.button_widgets = []
-        self.header_frame = None
-        self.main_frame = None
-        self.progress_frame = None
-        self.left_fill = None
-        self.spacer = None
-        self.button_frame = None
-        self.volume_frame = None
-        self.vol_slider_holder = None
-        self.canvas = None
-        self.progress_slider = None
-        self.vol_slider = None
-        self.progress_deco_label = None
-        self._theme_animation = None
-        self._theme_animation_id = None
-        self.canvas_size = CANVAS_SIZE
-        width = max(420, self.canvas_size[0] + 120)
-        height = self.canvas_size[1] + 380
-        self.root.geometry(f"{width}x{height}")
-        self.root.resizable(False, False)
-        self.root.configure(bg=COLORS['bg'])
-        self.scene = SakuraScene(self.canvas_size)
-        self._scene_photo = None
-        self._scene_photo_source = None
+def song_sort_key(path):
+    return stem_sort_key(Path(path).stem)
+
+
+def stem_sort_key(stem):
+    name = stem.lower()
+    if "cruel" in name and "angel" in name:
+        return (0, name)
+    if "komm" in name and "susser" in name:
+        return (1, name)
+    return (2, name)
+
+
+def probe_track(path):
+    info = {'duration': 0.0, 'title': None, 'artist': None, 'album': None}
+    try:
+        audio = mutagen_mp3.MP3(path)
+    except Exception:
+        return info
+    try:
+        info['duration'] = float(audio.info.length)
+    except Exception:
+        info['duration'] = 0.0
+    tags = audio.tags
+    if tags:
+        for key, frame_id in (('title', 'TIT2'), ('artist', 'TPE1'), ('album', 'TALB')):
+            frame = tags.get(frame_id)
+            if frame is not None and getattr(frame, 'text', None):
+                info[key] = str(frame.text[0])
+    return info
+
+
+MPEG_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000)
+}
+MPEG_BITRATES = {
+    (3, 3): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (3, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (3, 1): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 3): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 1): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
 
-        self.songs = []
-        self.idx = 0
-        self.playing = False
-        self.scrubbing = False
-        self.was_playing_before_seek = False
-        self.elapsed = 0.0
-        self.duration = 0.0
-        self.play_start_offset = 0.0
-        self.play_start_monotonic = 0.0
-        self.last_anim_tick = time.perf_counter()
 
-        self._suppress_vol_callback = False
-        self.is_muted = False
-        self.last_volume = 100.0
+def parse_mp3_header(data, offset):
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = (b1 >> 3) & 3
+    layer = (b1 >> 1) & 3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    sample_rate = MPEG_SAMPLE_RATES[version][rate_index]
+    bitrate = MPEG_BITRATES[(3 if version == 3 else 2, layer)][bitrate_index] * 1000
+    padding = (b2 >> 1) & 1
+    if layer == 3:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 1 and version != 3 else 1152
+        length = (samples // 8) * bitrate // sample_rate + padding
+    return {
+        'version': version,
+        'layer': 4 - layer,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'length': length,
+        'mono': (b3 >> 6) == 3
+    }
+
+
+def _id3v2_size(data):
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _find_frame(data, offset, limit=None):
+    end = len(data) if limit is None else min(len(data), limit)
+    while offset < end - 4:
+        offset = data.find(b'\xff', offset, end)
+        if offset < 0:
+            return None, None
+        header = parse_mp3_header(data, offset)
+        if header is not None:
+            # Require the following frame to line up too, otherwise a stray 0xFF in tag or junk data
+            # would be taken for a sync word.
+            following = offset + header['length']
+            if following + 4 > len(data) or parse_mp3_header(data, following) is not None:
+                return offset, header
+        offset += 1
+    return None, None
+
+
+def _vbr_header(data, offset, header):
+    if header['version'] == 3:
+        side = 17 if header['mono'] else 32
+    else:
+        side = 9 if header['mono'] else 17
+    xing = offset + 4 + side
+    tag = bytes(data[xing:xing + 4])
+    if tag in (b'Xing', b'Info'):
+        flags = struct.unpack_from('>I', data, xing + 4)[0]
+        cursor = xing + 8
+        frames = total = None
+        toc = None
+        if flags & 1:
+            frames = struct.unpack_from('>I', data, cursor)[0]
+            cursor += 4
+        if flags & 2:
+            total = struct.unpack_from('>I', data, cursor)[0]
+            cursor += 4
+        if flags & 4:
+            toc = list(data[cursor:cursor + 100])
+        return {'kind': 'xing', 'frames': frames, 'bytes': total, 'toc': toc}
+    vbri = offset + 4 + 32
+    if bytes(data[vbri:vbri + 4]) == b'VBRI':
+        total, frames, entries, scale, entry_size, per_entry = struct.unpack_from('>IIHHHH', data, vbri + 10)
+        cursor = vbri + 26
+        sizes = []
+        for _ in range(entries):
+            sizes.append(int.from_bytes(data[cursor:cursor + entry_size], 'big') * scale)
+            cursor += entry_size
+        return {'kind': 'vbri', 'frames': frames, 'bytes': total, 'sizes': sizes, 'frames_per_entry': per_entry}
+    return None
+
+
+def scan_mp3_frames(data):
+    start, header = _find_frame(data, _id3v2_size(data))
+    if start is None:
+        return None, [], None
+    vbr = _vbr_header(data, start, header)
+    offsets = []
+    offset = start
+    if vbr is not None:
+        # The Xing/VBRI frame is metadata, not audio.
+        offset += header['length']
+    end = len(data)
+    if end >= 128 and bytes(data[end - 128:end - 125]) == b'TAG':
+        end -= 128
+    while offset < end - 4:
+        current = parse_mp3_header(data, offset)
+        if current is None:
+            offset, current = _find_frame(data, offset + 1, end)
+            if offset is None:
+                break
+        offsets.append(offset)
+        offset += current['length']
+    return header, offsets, vbr
+
+
+class Mp3SeekIndex:
+    STRIDE = 16
+
+    def __init__(self, path, size, mtime_ns, sample_rate, samples, frame_count, offsets, stride=STRIDE):
+        self.path = str(path)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sample_rate = sample_rate
+        self.samples = samples
+        self.frame_count = frame_count
+        self.offsets = offsets
+        self.stride = stride
+
+    @property
+    def frame_seconds(self):
+        return self.samples / float(self.sample_rate)
+
+    @property
+    def duration(self):
+        return self.frame_count * self.frame_seconds
+
+    def locate(self, seconds):
+        if not self.frame_count:
+            return 0, 0.0
+        frame = max(0, min(self.frame_count - 1, int(seconds / self.frame_seconds)))
+        checkpoint = frame // self.stride
+        offset = self.offsets[checkpoint]
+        remaining = frame - checkpoint * self.stride
+        if remaining:
+            # Checkpoints keep the cache small; walk the few frame headers between the checkpoint
+            # and the target so the result is still frame-exact.
+            with open(self.path, 'rb') as handle:
+                handle.seek(offset)
+                chunk = handle.read(remaining * 2900 + 4)
+            cursor = 0
+            for _ in range(remaining):
+                header = parse_mp3_header(chunk, cursor)
+                if header is None:
+                    break
+                cursor += header['length']
+            else:
+                offset += cursor
+                return offset, frame * self.frame_seconds
+            frame = checkpoint * self.stride
+        return offset, frame * self.frame_seconds
 
-        self.play_img = None
-        self.pause_img = None
+    def to_row(self):
+        return (
+            self.path, self.size, self.mtime_ns, self.sample_rate, self.samples,
+            self.frame_count, self.stride, self.offsets.tobytes()
+        )
 
-        self.load_assets()
-        self.setup_ui()
-        self._refresh_theme_ui(refresh_scene=False)
-        self.load_music()
-        self.animate()
-        self.update_display()
+    @classmethod
+    def from_row(cls, row):
+        offsets = array.array('Q')
+        offsets.frombytes(row['offsets'])
+        return cls(
+            row['path'], row['size'], row['mtime_ns'], row['sample_rate'], row['samples'],
+            row['frame_count'], offsets, row['stride']
+        )
 
 
-    def load_assets(self):
-        assets_path = Path(__file__).parent / 'assets'
-        self.play_img = self._load_photo(assets_path, 'blueresume-removebg-preview.png', (68, 68))
-        self.pause_img = self._load_photo(assets_path, 'bluepause-removebg-preview.png', (68, 68))
-        self.back_img = self._load_photo(assets_path, 'leftarrow-removebg-preview.png', (44, 44))
-        self.next_img = self._load_photo(assets_path, 'rightarrow-removebg-preview.png', (44, 44))
-        self.vol_on_img = self._load_photo(assets_path, 'volumeon-removebg-preview.png', (40, 40))
-        self.vol_off_img = self._load_photo(assets_path, 'volumeoff-removebg-preview.png', (40, 40))
+def build_seek_index(path, stride=Mp3SeekIndex.STRIDE):
+    path = str(path)
+    with open(path, 'rb') as handle:
+        stat = os.fstat(handle.fileno())
+        if not stat.st_size:
+            return None
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header, frames, _vbr = scan_mp3_frames(data)
+    if header is None or not frames:
+        return None
+    offsets = array.array('Q', frames[::stride])
+    return Mp3SeekIndex(path, stat.st_size, stat.st_mtime_ns, header['sample_rate'], header['samples'], len(frames), offsets, stride)
+
+
+def waveform_peaks(samples, buckets=WAVEFORM_BUCKETS):
+    # min/max per bucket as uint8 pairs (0 = -1.0, 255 = +1.0), scaled to the track's own peak so quiet
+    # recordings still show their shape.
+    samples = np.asarray(samples)
+    samples = samples.reshape(len(samples), -1)
+    if not len(samples):
+        return bytes([128, 128]) * buckets
+    edges = (np.arange(buckets) * len(samples)) // buckets
+    lows = np.minimum.reduceat(samples.min(axis=1), edges).astype(np.float32)
+    highs = np.maximum.reduceat(samples.max(axis=1), edges).astype(np.float32)
+    scale = max(float(np.abs(lows).max()), float(np.abs(highs).max()), 1.0)
+    pairs = np.stack([lows, highs], axis=1) / scale
+    return np.clip(np.rint((pairs + 1.0) * 127.5), 0, 255).astype(np.uint8).tobytes()
+
+
+def waveform_columns(peaks, columns):
+    # Folds the stored buckets into `columns` (low, high) pairs in -1..1, for whatever width the slider has.
+    buckets = len(peaks) // 2
+    if not buckets or columns <= 0:
+        return []
+    if np is not None:
+        pairs = np.frombuffer(peaks, dtype=np.uint8).reshape(buckets, 2)
+        edges = (np.arange(columns) * buckets) // columns
+        lows = np.minimum.reduceat(pairs[:, 0], edges) / 127.5 - 1.0
+        highs = np.maximum.reduceat(pairs[:, 1], edges) / 127.5 - 1.0
+        return list(zip(lows.tolist(), highs.tolist()))
+    result = []
+    for column in range(columns):
+        start = column * buckets // columns
+        end = max(start + 1, (column + 1) * buckets // columns)
+        result.append((
+            min(peaks[start * 2:end * 2:2]) / 127.5 - 1.0,
+            max(peaks[start * 2 + 1:end * 2:2]) / 127.5 - 1.0
+        ))
+    return result
+
+
+def _init_decode_worker(frequency=WAVEFORM_RATE, channels=1):
+    # Worker processes decode through SDL's dummy driver, so no sound device is opened. Waveforms use a low
+    # mono rate, which is plenty for a few hundred pixels of peaks; loudness needs both channels.
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    pygame.load()
+    pygame.mixer.quit()
+    pygame.mixer.init(frequency=frequency, size=-16, channels=channels)
+
+
+def compute_waveform(path, buckets=WAVEFORM_BUCKETS):
+    path = str(path)
+    stat = os.stat(path)
+    samples = pygame.sndarray.array(pygame.mixer.Sound(path))
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'peaks': waveform_peaks(samples, buckets)}
+
+
+def k_weighting(frequencies, rate):
+    # Power response of the BS.1770 K-weighting (+4 dB shelf around 1.5 kHz, then a 38 Hz high-pass),
+    # derived for `rate` instead of using the published 48 kHz coefficients.
+    z = np.exp(-2j * np.pi * np.asarray(frequencies, dtype=np.float64) / rate)
+    gain = 10 ** (4.0 / 40.0)
+    w0 = 2 * np.pi * 1500.0 / rate
+    alpha = np.sin(w0) / np.sqrt(2.0)
+    root = 2 * np.sqrt(gain) * alpha
+    shelf = (
+        gain * ((gain + 1) + (gain - 1) * np.cos(w0) + root)
+        - 2 * gain * ((gain - 1) + (gain + 1) * np.cos(w0)) * z
+        + gain * ((gain + 1) + (gain - 1) * np.cos(w0) - root) * z * z
+    ) / (
+        ((gain + 1) - (gain - 1) * np.cos(w0) + root)
+        + 2 * ((gain - 1) - (gain + 1) * np.cos(w0)) * z
+        + ((gain + 1) - (gain - 1) * np.cos(w0) - root) * z * z
+    )
+    w0 = 2 * np.pi * 38.0 / rate
+    alpha = np.sin(w0)
+    highpass = (1 - 2 * z + z * z) / ((1 + alpha) - 2 * np.cos(w0) * z + (1 - alpha) * z * z)
+    return np.abs(shelf * highpass) ** 2
+
+
+def loudness_lufs(samples, rate, chunk=256):
+    # Gated integrated loudness (EBU R128 / BS.1770) of int16 PCM. K-weighted power is taken per 100 ms
+    # step from its spectrum, a whole chunk of steps per FFT call, rather than by running the IIR filters
+    # sample by sample. 400 ms blocks overlapping by 75% are then just sums of four steps.
+    samples = np.asarray(samples)
+    samples = samples.reshape(len(samples), -1)
+    step = rate // 10
+    steps = len(samples) // step
+    if steps < 4:
+        return None
+    weights = k_weighting(np.fft.rfftfreq(step, 1.0 / rate), rate)
+    weights[1:(step + 1) // 2] *= 2.0
+    weights = (weights / (step * step * 32768.0 * 32768.0)).astype(np.float32)
+    power = np.empty(steps, dtype=np.float64)
+    for start in range(0, steps, chunk):
+        end = min(steps, start + chunk)
+        block = samples[start * step:end * step].reshape(end - start, step, -1).astype(np.float32)
+        spectrum = np.fft.rfft(block, axis=1)
+        energy = spectrum.real * spectrum.real + spectrum.imag * spectrum.imag
+        # Channel weights are all 1 for stereo, so the per-channel powers just add.
+        power[start:end] = np.einsum('sfc,f->s', energy, weights)
+    blocks = (power[:-3] + power[1:-2] + power[2:-1] + power[3:]) / 4.0
+    kept = blocks[blocks > 10 ** ((-70.0 + 0.691) / 10.0)]
+    if not len(kept):
+        return None
+    kept = kept[kept > kept.mean() / 10.0]
+    return -0.691 + 10.0 * math.log10(float(kept.mean()))
 
-        deco_path = Path(__file__).parent / 'deco'
-        self.vol_heart_img = None
-        self.vol_knob_img = self._load_photo(deco_path, 'pixelreiheart-removebg-preview.png', (44, 44))
-        self.progress_deco_img = self._load_photo(deco_path, 'shinjipixelchair-removebg-preview.png', (64, 64))
-        self.progress_knob_img = self._load_photo(deco_path, 'reidrag-removebg-preview.png', (40, 40))
-        self.light_mode_icon = self._load_photo(deco_path, 'lightmodestars-removebg-preview.png', (32, 32))
-        self.dark_mode_icon = self._load_photo(deco_path, 'darkmodemoon-removebg-preview.png', (32, 32))
-        self.vol_heart_label = None
-        self.vol_heart_item = None
 
-    def _load_photo(self, folder, filename, size):
+def _replaygain_value(text):
+    try:
+        return float(str(text).strip().split()[0])
+    except Exception:
+        return None
+
+
+def replaygain_tags(path):
+    # Track gain (and peak) already written by a ReplayGain tagger: ID3 TXXX frames (foobar2000, loudgain)
+    # or an APEv2 tag (mp3gain). Album gain is ignored; playback here follows whatever order the queue picks.
+    values = {}
+    try:
+        tags = mutagen_mp3.MP3(path).tags
+    except Exception:
+        tags = None
+    if tags:
+        for frame in tags.getall('TXXX'):
+            desc = str(frame.desc).lower()
+            if desc in ('replaygain_track_gain', 'replaygain_track_peak') and frame.text:
+                values[desc] = _replaygain_value(frame.text[0])
+    if values.get('replaygain_track_gain') is None:
         try:
-            img = Image.open(folder / filename).convert('RGBA')
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            return ImageTk.PhotoImage(img)
+            ape = mutagen_apev2.APEv2(path)
         except Exception:
-            return None
+            ape = None
+        if ape is not None:
+            for key in ape.keys():
+                desc = key.lower()
+                if desc in ('replaygain_track_gain', 'replaygain_track_peak'):
+                    values[desc] = _replaygain_value(ape[key])
+    if values.get('replaygain_track_gain') is None:
+        return None
+    return {'gain': values['replaygain_track_gain'], 'peak': values.get('replaygain_track_peak')}
+
+
+def compute_loudness(path):
+    path = str(path)
+    stat = os.stat(path)
+    info = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    tagged = replaygain_tags(path)
+    if tagged is not None:
+        info.update(tagged, source='tag')
+        return info
+    if np is None:
+        return None
+    samples = pygame.sndarray.array(pygame.mixer.Sound(path))
+    lufs = loudness_lufs(samples, pygame.mixer.get_init()[0])
+    # Silence and sub-400 ms clips have no gated blocks; leave them at unity.
+    info['gain'] = LOUDNESS_TARGET - lufs if lufs is not None else 0.0
+    info['peak'] = float(np.abs(samples.astype(np.int32)).max()) / 32768.0 if samples.size else 0.0
+    info['source'] = 'scan'
+    return info
+
+
+def loudness_factor(gain, peak=None):
+    # Linear volume multiplier for a track's gain, held back so its peak cannot clip.
+    factor = 10.0 ** (gain / 20.0)
+    if peak:
+        factor = min(factor, 1.0 / peak)
+    return factor
+
+
+def toc_seek_offset(path, seconds, duration, use_toc=True):
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    start, header = _find_frame(data, _id3v2_size(data))
+    if start is None or duration <= 0:
+        return None
+    vbr = _vbr_header(data, start, header)
+    audio_start = start + (header['length'] if vbr else 0)
+    if not use_toc:
+        vbr = None
+    ratio = max(0.0, min(1.0, seconds / duration))
+    if vbr and vbr['kind'] == 'xing' and vbr['toc'] and vbr['bytes']:
+        percent = ratio * 100.0
+        index = min(99, int(percent))
+        low = vbr['toc'][index]
+        high = vbr['toc'][index + 1] if index < 99 else 256
+        position = start + (low + (high - low) * (percent - index)) / 256.0 * vbr['bytes']
+    elif vbr and vbr['kind'] == 'vbri' and vbr['sizes']:
+        target = ratio * vbr['frames']
+        position = audio_start
+        for size in vbr['sizes']:
+            if target < vbr['frames_per_entry']:
+                position += size * target / vbr['frames_per_entry']
+                break
+            position += size
+            target -= vbr['frames_per_entry']
+    else:
+        # No VBR table: the same constant-bitrate assumption the mixer's own seek makes.
+        position = audio_start + ratio * (len(data) - audio_start)
+    offset, _header = _find_frame(data, int(position))
+    return offset
+
+
+class OffsetFile:
+    def __init__(self, path, offset):
+        self.handle = open(path, 'rb')
+        self.base = offset
+        self.size = os.fstat(self.handle.fileno()).st_size - offset
+        self.handle.seek(offset)
+
+    def read(self, size=-1):
+        return self.handle.read(size)
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            target = self.base + position
+        elif whence == os.SEEK_CUR:
+            target = self.handle.tell() + position
+        else:
+            target = self.base + self.size + position
+        return self.handle.seek(max(self.base, target)) - self.base
 
-    def setup_ui(self):
-        self.main_frame = tk.Frame(self.root, bg=COLORS['bg'])
-        self.main_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=10)
-        main_frame = self.main_frame
+    def tell(self):
+        return self.handle.tell() - self.base
 
-        self.header_frame = tk.Frame(main_frame, bg=COLORS['bg'])
-        self.header_frame.pack(fill=tk.X, pady=(0, 2))
+    def close(self):
+        self.handle.close()
 
-        if self.dark_mode_icon or self.light_mode_icon:
-            initial_icon = self.dark_mode_icon if self.theme == 'light' and self.dark_mode_icon else self.light_mode_icon
-            self.theme_button = tk.Label(
-                self.header_frame,
-                image=initial_icon,
-                bg=COLORS['bg'],
-                cursor='hand2',
-                bd=0,
-                highlightthickness=0
-            )
-            if initial_icon:
-                self.theme_button.image = initial_icon
-            else:
-                self.theme_button.config(text='🌙', fg=COLORS['text'])
-            self.theme_button.pack(side=tk.RIGHT)
-            self.theme_button.bind('<Button-1>', self.toggle_theme)
-        else:
-            self.theme_button = tk.Label(
-                self.header_frame,
-                text='🌙',
-                bg=COLORS['bg'],
-                fg=COLORS['text'],
-                cursor='hand2'
-            )
-            self.theme_button.pack(side=tk.RIGHT)
-            self.theme_button.bind('<Button-1>', self.toggle_theme)
 
-        self.canvas = tk.Canvas(
-            main_frame,
-            width=self.canvas_size[0],
-            height=self.canvas_size[1],
-            bg=COLORS['bg'],
-            highlightthickness=0
-        )
-        self.canvas.pack(pady=(0, 8))
+class PlaybackClock:
+    def __init__(self, now=time.perf_counter):
+        self.now = now
+        self.offset = 0.0
+        self.started = None
+        self.duration = 0.0
 
-        self.title_label = tk.Label(
+    @property
+    def running(self):
+        return self.started is not None
+
+    def reset(self, duration=0.0):
+        self.offset = 0.0
+        self.started = None
+        self.duration = max(0.0, float(duration or 0.0))
+
+    def start(self, position):
+        self.offset = max(0.0, float(position))
+        self.started = self.now()
+
+    def pause(self):
+        self.hold(self.position())
+
+    def hold(self, position):
+        self.offset = max(0.0, float(position))
+        self.started = None
+
+    def position(self):
+        position = self.offset
+        if self.started is not None:
+            position += self.now() - self.started
+        if self.duration > 0:
+            position = min(position, self.duration)
+        return position
+
+    def remaining(self):
+        if self.duration <= 0:
+            return None
+        return max(0.0, self.duration - self.position())
+
+    def next_change(self, pixels):
+        if self.started is None:
+            return None
+        position = self.position()
+        wait = 1.0 - position % 1.0
+        if self.duration > 0 and pixels > 0:
+            # The slider rounds to the nearest pixel, so it moves when the position crosses a half-pixel.
+            per_pixel = self.duration / float(pixels)
+            phase = position / per_pixel + 0.5
+            wait = min(wait, (math.floor(phase) + 1.0 - phase) * per_pixel)
+        return max(0.005, wait)
+
+
+class WidgetStyler:
+    def __init__(self):
+        self.applied = {}
+        self.calls = 0
+        self.requested = 0
+
+    def configure(self, widget, **options):
+        if widget is None:
+            return
+        self.requested += 1
+        applied = self.applied.setdefault(str(widget), {})
+        changed = {name: value for name, value in options.items() if name not in applied or applied[name] != value}
+        if not changed:
+            return
+        try:
+            widget.configure(**changed)
+        except Exception:
+            return
+        applied.update(changed)
+        self.calls += 1
+
+    def forget(self, widget):
+        self.applied.pop(str(widget), None)
+
+
+class ThemeTransition:
+    def __init__(self, start_map, target_map, duration=0.45, step=0.016, clock=time.perf_counter):
+        self.target_map = dict(target_map)
+        self.duration = max(0.05, duration)
+        self.clock = clock
+        self.started = clock()
+        count = max(2, int(math.ceil(self.duration / step)) + 1)
+        start_rgb = {key: hex_to_rgb(start_map.get(key, value)) for key, value in target_map.items()}
+        target_rgb = {key: hex_to_rgb(value) for key, value in target_map.items()}
+        self.palettes = []
+        for number in range(count):
+            progress = number / (count - 1)
+            eased = progress * progress * (3.0 - 2.0 * progress)
+            palette = {}
+            for key, end in target_rgb.items():
+                begin = start_rgb[key]
+                palette[key] = rgb_to_hex(tuple(begin[i] + (end[i] - begin[i]) * eased for i in range(3)))
+            self.palettes.append(palette)
+        self.palettes[-1] = dict(self.target_map)
+
+    def frame(self):
+        progress = max(0.0, min(1.0, (self.clock() - self.started) / self.duration))
+        return int(round(progress * (len(self.palettes) - 1))), progress >= 1.0
+
+
+class FrameScheduler:
+    AUDIO = 0
+    SLIDER = 1
+    SCENE = 2
+    DECORATION = 3
+
+    def __init__(self, root, fps=60, clock=time.perf_counter):
+        self.root = root
+        self.clock = clock
+        self.frame = 1.0 / float(fps)
+        self.tasks = {}
+        self.stats = {'ticks': 0, 'late': 0, 'dropped': 0, 'deferred': 0, 'overruns': 0}
+        self._after_id = None
+        self._planned = None
+        self._running = False
+
+    def add(self, name, callback, priority, interval=None, budget=None, start=True):
+        self.tasks[name] = {
+            'name': name,
+            'callback': callback,
+            'priority': priority,
+            'interval': interval,
+            'budget': budget if budget is not None else self.frame,
+            'due': None,
+            'runs': 0,
+            'overruns': 0,
+            'dropped': 0,
+            'deferred': 0,
+            'seconds': 0.0,
+            'last_ms': 0.0
+        }
+        if start:
+            self.wake(name)
+
+    def wake(self, name, delay=0.0):
+        self.tasks[name]['due'] = self.clock() + max(0.0, delay)
+        self._arm()
+
+    def sleep(self, name):
+        task = self.tasks.get(name)
+        if task is not None:
+            task['due'] = None
+
+    def is_awake(self, name):
+        task = self.tasks.get(name)
+        return task is not None and task['due'] is not None
+
+    def stop(self):
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+        for task in self.tasks.values():
+            task['due'] = None
+
+    def _arm(self):
+        if self._running:
+            return
+        pending = [task['due'] for task in self.tasks.values() if task['due'] is not None]
+        if not pending:
+            if self._after_id is not None:
+                try:
+                    self.root.after_cancel(self._after_id)
+                except Exception:
+                    pass
+                self._after_id = None
+                self._planned = None
+            return
+        due = min(pending)
+        if self._after_id is not None and self._planned is not None and self._planned <= due:
+            return
+        if self._after_id is not None:
+            try:
+                self.root.after_cancel(self._after_id)
+            except Exception:
+                pass
+        delay = max(0.0, due - self.clock())
+        self._planned = due
+        self._after_id = self.root.after(max(1, int(delay * 1000.0 + 0.5)), self._tick)
+
+    def _tick(self):
+        self._after_id = None
+        now = self.clock()
+        stats = self.stats
+        stats['ticks'] += 1
+        if self._planned is not None and now - self._planned > self.frame:
+            stats['late'] += 1
+        self._planned = None
+        deadline = now + self.frame
+        due = sorted(
+            (task for task in self.tasks.values() if task['due'] is not None and task['due'] <= now),
+            key=lambda task: (task['priority'], task['due'])
+        )
+        self._running = True
+        try:
+            for task in due:
+                interval = task['interval']
+                if interval:
+                    # Periodic work never catches up; whole intervals that slipped by are dropped frames.
+                    missed = int((now - task['due']) / interval)
+                    if missed:
+                        task['dropped'] += missed
+                        stats['dropped'] += missed
+                if task['priority'] > self.SLIDER and self.clock() > deadline:
+                    task['deferred'] += 1
+                    stats['deferred'] += 1
+                    task['due'] = deadline
+                    continue
+                task['due'] = None
+                started = self.clock()
+                try:
+                    result = task['callback']()
+                except Exception:
+                    result = None
+                elapsed = self.clock() - started
+                instruments.record('task.' + task['name'], elapsed)
+                task['runs'] += 1
+                task['seconds'] += elapsed
+                task['last_ms'] = elapsed * 1000.0
+                if elapsed > task['budget']:
+                    task['overruns'] += 1
+                    stats['overruns'] += 1
+                if result is False:
+                    task['due'] = None
+                elif isinstance(result, (int, float)) and not isinstance(result, bool):
+                    task['due'] = started + max(0.0, float(result))
+                elif task['due'] is None and interval:
+                    task['due'] = started + interval
+        finally:
+            self._running = False
+        instruments.record('frame', self.clock() - now)
+        self._arm()
+
+
+class SceneRenderWorker:
+    BUFFERS = 3
+
+    def __init__(self, scene, interval=1 / 30.0):
+        self.scene = scene
+        self.interval = interval
+        self.buffers = [None] * self.BUFFERS
+        self.front = None
+        self.reading = None
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.stats = {'frames': 0, 'unchanged': 0, 'last_render_ms': 0.0, 'render_ms_total': 0.0}
+        self._source = None
+        self._version = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rei-render', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    def acquire(self):
+        with self.lock:
+            self.reading = self.front
+            if self.front is None:
+                return None, 0
+            return self.buffers[self.front], self.sequence
+
+    def release(self):
+        with self.lock:
+            self.reading = None
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            dt = max(0.0, min(now - last, 0.12))
+            last = now
+            scene = self.scene
+            started = time.perf_counter()
+            scene.step(dt)
+            frame = scene.render()
+            version = getattr(scene, 'version', None)
+            if frame is self._source and version == self._version:
+                self.stats['unchanged'] += 1
+            else:
+                self._publish(frame)
+                self._source = frame
+                self._version = version
+                elapsed = (time.perf_counter() - started) * 1000.0
+                self.stats['frames'] += 1
+                self.stats['last_render_ms'] = elapsed
+                self.stats['render_ms_total'] += elapsed
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - now)))
+
+    def _publish(self, frame):
+        with self.lock:
+            slot = next(index for index in range(self.BUFFERS) if index not in (self.front, self.reading))
+        # Scenes may hand back a retained canvas they keep drawing into, so copy it into a buffer the
+        # Tk thread is not reading before flipping.
+        target = self.buffers[slot]
+        if target is None or target.size != frame.size or target.mode != frame.mode:
+            target = frame.copy()
+        else:
+            target.paste(frame)
+        with self.lock:
+            self.buffers[slot] = target
+            self.front = slot
+            self.sequence += 1
+
+
+def warm_file_cache(path, chunk_size=1 << 20):
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL | os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+        # fadvise is only a hint (and a no-op on many network mounts), so pull the bytes through anyway.
+        buffer = bytearray(chunk_size)
+        with open(fd, 'rb', buffering=0, closefd=False) as handle:
+            while handle.readinto(buffer):
+                pass
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class LibraryIndex:
+    COLUMNS = ('path', 'folder', 'size', 'mtime_ns', 'duration', 'title', 'artist', 'album')
+    # Per-file caches keyed by path and checked against the track's size and mtime_ns on read.
+    CACHES = ('seek_index', 'waveform', 'loudness')
+
+    def __init__(self, db_path=LIBRARY_INDEX_PATH):
+        self.db_path = db_path
+        self.conn = self._connect(db_path)
+        self.last_scan = {'listed': 0, 'probed': 0, 'removed': 0, 'seconds': 0.0}
+
+    def _connect(self, db_path):
+        conn = None
+        if db_path != ':memory:':
+            try:
+                Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(str(db_path))
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+            except Exception:
+                conn = None
+        if conn is None:
+            self.db_path = ':memory:'
+            conn = sqlite3.connect(':memory:')
+        conn.row_factory = sqlite3.Row
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            'path TEXT PRIMARY KEY, folder TEXT NOT NULL, size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, duration REAL, title TEXT, artist TEXT, album TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS tracks_folder ON tracks(folder)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS seek_index ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sample_rate INTEGER NOT NULL, '
+            'samples INTEGER NOT NULL, frame_count INTEGER NOT NULL, stride INTEGER NOT NULL, offsets BLOB NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS waveform ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, peaks BLOB NOT NULL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS loudness ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, gain REAL NOT NULL, '
+            'peak REAL, source TEXT NOT NULL)'
+        )
+        conn.commit()
+        return conn
+
+    def tracks(self, folder):
+        rows = self.conn.execute('SELECT * FROM tracks WHERE folder = ?', (str(folder),))
+        return {row['path']: dict(row) for row in rows}
+
+    def get(self, path):
+        row = self.conn.execute('SELECT * FROM tracks WHERE path = ?', (str(path),)).fetchone()
+        return dict(row) if row else None
+
+    def scan(self, folder, probe=probe_track):
+        started = time.perf_counter()
+        folder = str(folder)
+        known = self.tracks(folder)
+        records = []
+        changed = []
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            entries = []
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.') or not name.endswith('.mp3'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            path = os.path.join(folder, name)
+            record = known.pop(path, None)
+            if record is None or record['size'] != stat.st_size or record['mtime_ns'] != stat.st_mtime_ns:
+                record = {
+                    'path': path,
+                    'folder': folder,
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns
+                }
+                if probe is not None:
+                    record.update(probe(path))
+                else:
+                    record.update({'duration': None, 'title': None, 'artist': None, 'album': None})
+                changed.append(record)
+            records.append(record)
+        with self.conn:
+            if changed:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [tuple(record[column] for column in self.COLUMNS) for record in changed]
+                )
+            if known:
+                for table in ('tracks',) + self.CACHES:
+                    self.conn.executemany(f'DELETE FROM {table} WHERE path = ?', [(path,) for path in known])
+        self.last_scan = {
+            'listed': len(records),
+            'probed': len(changed),
+            'removed': len(known),
+            'seconds': time.perf_counter() - started
+        }
+        instruments.record('library.scan', self.last_scan['seconds'])
+        return records
+
+    def refresh(self, paths):
+        records = []
+        for path in paths:
+            path = str(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            records.append({
+                'path': path,
+                'folder': os.path.dirname(path),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'duration': None,
+                'title': None,
+                'artist': None,
+                'album': None
+            })
+        if records:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [tuple(record[column] for column in self.COLUMNS) for record in records]
+                )
+        return records
+
+    def remove(self, paths):
+        if not paths:
+            return
+        with self.conn:
+            for table in ('tracks',) + self.CACHES:
+                self.conn.executemany(f'DELETE FROM {table} WHERE path = ?', [(str(path),) for path in paths])
+
+    def rename(self, pairs):
+        if not pairs:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE OR REPLACE tracks SET path = ?, folder = ? WHERE path = ?',
+                [(str(new), os.path.dirname(str(new)), str(old)) for old, new in pairs]
+            )
+            for table in self.CACHES:
+                self.conn.executemany(
+                    f'UPDATE OR REPLACE {table} SET path = ? WHERE path = ?',
+                    [(str(new), str(old)) for old, new in pairs]
+                )
+
+    def update_metadata(self, updates):
+        if not updates:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE tracks SET duration = ?, title = ?, artist = ?, album = ? WHERE path = ?',
+                [(info['duration'], info['title'], info['artist'], info['album'], str(path)) for path, info in updates]
+            )
+
+    def seek_index(self, path):
+        record = self.conn.execute(
+            'SELECT s.* FROM seek_index s JOIN tracks t ON t.path = s.path '
+            'WHERE s.path = ? AND s.size = t.size AND s.mtime_ns = t.mtime_ns',
+            (str(path),)
+        ).fetchone()
+        return Mp3SeekIndex.from_row(record) if record else None
+
+    def store_seek_indexes(self, indexes):
+        if not indexes:
+            return
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO seek_index VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [index.to_row() for index in indexes]
+            )
+
+    def waveform(self, path):
+        record = self.conn.execute(
+            'SELECT w.peaks FROM waveform w JOIN tracks t ON t.path = w.path '
+            'WHERE w.path = ? AND w.size = t.size AND w.mtime_ns = t.mtime_ns',
+            (str(path),)
+        ).fetchone()
+        return bytes(record['peaks']) if record else None
+
+    def store_waveforms(self, rows):
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO waveform VALUES (?, ?, ?, ?)', rows)
+
+    def loudness(self, path):
+        record = self.conn.execute(
+            'SELECT l.gain, l.peak, l.source FROM loudness l JOIN tracks t ON t.path = l.path '
+            'WHERE l.path = ? AND l.size = t.size AND l.mtime_ns = t.mtime_ns',
+            (str(path),)
+        ).fetchone()
+        return dict(record) if record else None
+
+    def loudness_paths(self, folder=None):
+        query = (
+            'SELECT l.path FROM loudness l JOIN tracks t ON t.path = l.path '
+            'WHERE l.size = t.size AND l.mtime_ns = t.mtime_ns'
+        )
+        if folder is None:
+            rows = self.conn.execute(query)
+        else:
+            rows = self.conn.execute(query + ' AND t.folder = ?', (str(folder),))
+        return {row['path'] for row in rows}
+
+    def store_loudness(self, rows):
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class MetadataService:
+    URGENT = 0
+    AHEAD = 1
+    BACKGROUND = 2
+
+    def __init__(self, workers=None, probe=probe_track):
+        self.probe = probe
+        self.stage = 'probe.' + getattr(probe, '__name__', 'probe')
+        self.requests = queue.PriorityQueue()
+        self.results = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self._sequence = 0
+        self._closed = False
+        count = workers or max(2, min(8, (os.cpu_count() or 2)))
+        self.threads = []
+        for number in range(count):
+            thread = threading.Thread(target=self._worker, name=f'rei-metadata-{number}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def request(self, path, priority=BACKGROUND):
+        key = str(path)
+        with self.lock:
+            if self._closed:
+                return
+            self._sequence += 1
+            # Re-queueing at a better priority is allowed; the worker skips keys that already finished.
+            self.pending.add(key)
+            self.requests.put((priority, self._sequence, key))
+
+    def prefetch(self, paths, start=0):
+        paths = list(paths)
+        if not paths:
+            return
+        start %= len(paths)
+        ordered = paths[start:] + paths[:start]
+        for offset, path in enumerate(ordered):
+            self.request(path, self.AHEAD if offset < 8 else self.BACKGROUND)
+
+    def is_pending(self, path):
+        with self.lock:
+            return str(path) in self.pending
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.pending) or not self.results.empty()
+
+    def drain(self, limit=256):
+        finished = []
+        while len(finished) < limit:
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        return finished
+
+    def _worker(self):
+        while True:
+            _priority, _sequence, key = self.requests.get()
+            if key is None:
+                return
+            with self.lock:
+                if key not in self.pending:
+                    continue
+            try:
+                with instruments.timer(self.stage):
+                    info = self._run(key)
+            except Exception:
+                info = None
+            with self.lock:
+                if key not in self.pending:
+                    continue
+                self.pending.discard(key)
+            self.results.put((key, info))
+
+    def _run(self, key):
+        return self.probe(key)
+
+    def shutdown(self):
+        with self.lock:
+            self._closed = True
+            self.pending.clear()
+            for _ in self.threads:
+                self._sequence += 1
+                self.requests.put((-1, self._sequence, None))
+
+
+class DecodeService(MetadataService):
+    # Same prioritised queue as the tag probes, but decoding is CPU-bound, so each worker thread just hands
+    # its file to a process pool and waits; the Tk process never decodes a sample. The pool is spawned (not
+    # forked: this process has Tk and threads) on the first request.
+    DECODE = (WAVEFORM_RATE, 1)
+
+    def __init__(self, workers, probe):
+        self.processes = workers or max(1, min(4, (os.cpu_count() or 2) // 2))
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        super().__init__(workers=self.processes, probe=probe)
+
+    def _run(self, key):
+        with self._pool_lock:
+            if self._closed:
+                return None
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_decode_worker,
+                    initargs=self.DECODE
+                )
+            future = self.pool.submit(self.probe, key)
+        return future.result()
+
+    def shutdown(self):
+        super().shutdown()
+        with self._pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class WaveformService(DecodeService):
+    DECODE = (WAVEFORM_RATE, 1)
+
+    def __init__(self, workers=None, probe=compute_waveform):
+        super().__init__(workers=workers, probe=probe)
+
+
+class LoudnessService(DecodeService):
+    # Tagged files never reach a decoder: compute_loudness reads ReplayGain tags first, in the worker.
+    DECODE = (LOUDNESS_RATE, 2)
+
+    def __init__(self, workers=None, probe=compute_loudness):
+        super().__init__(workers=workers, probe=probe)
+
+
+class MusicFolderWatcher:
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, folder, known_paths=(), debounce=0.3, max_delay=1.5, poll_interval=2.0, use_inotify=True):
+        self.folder = str(folder)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.batches = queue.Queue()
+        self.known = {}
+        self._expected = {os.path.basename(str(path)) for path in known_paths}
+        self.mode = None
+        self._use_inotify = use_inotify
+        self._stop = threading.Event()
+        self._thread = None
+        self._fd = None
+        self._dir_mtime = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        target = self._run_polling
+        if self._use_inotify:
+            self._fd = self._open_inotify()
+            if self._fd is not None:
+                target = self._run_inotify
+        self.mode = 'inotify' if target == self._run_inotify else 'polling'
+        self._thread = threading.Thread(target=self._run, args=(target,), name='rei-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def drain(self):
+        batches = []
+        while True:
+            try:
+                batches.append(self.batches.get_nowait())
+            except queue.Empty:
+                return batches
+
+    def _run(self, loop):
+        # Prime from the directory itself so files that changed between the library scan and the
+        # watch being armed still show up as a first batch.
+        self._dir_mtime = self._folder_mtime()
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if self._wanted(entry.name) and entry.is_file():
+                        self.known[entry.name] = entry.inode()
+        except OSError:
+            pass
+        missing = self._expected.difference(self.known)
+        extra = set(self.known).difference(self._expected)
+        for name in missing:
+            self.known[name] = None
+        for name in extra:
+            del self.known[name]
+        if missing or extra:
+            self._flush(missing | extra, set())
+        loop()
+
+    def _open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(self.folder), self.WATCH_MASK) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except Exception:
+            return None
+
+    def _run_inotify(self):
+        touched = set()
+        written = set()
+        first_event = last_event = 0.0
+        while not self._stop.is_set():
+            timeout = 0.5
+            if touched:
+                now = time.monotonic()
+                timeout = max(0.0, min(last_event + self.debounce, first_event + self.max_delay) - now)
+            try:
+                ready, _, _ = select.select([self._fd], [], [], timeout)
+            except (OSError, ValueError):
+                return
+            if ready:
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    data = b''
+                except OSError:
+                    return
+                now = time.monotonic()
+                if not touched:
+                    first_event = now
+                last_event = now
+                offset = 0
+                while offset + self.EVENT_HEADER.size <= len(data):
+                    _wd, mask, _cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                    offset += self.EVENT_HEADER.size
+                    name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                    offset += length
+                    if mask & self.IN_Q_OVERFLOW:
+                        touched.update(self._list_names())
+                        touched.update(self.known)
+                        continue
+                    if not self._wanted(name):
+                        continue
+                    touched.add(name)
+                    if mask & (self.IN_CLOSE_WRITE | self.IN_MODIFY):
+                        written.add(name)
+                continue
+            if touched:
+                self._flush(touched, written)
+                touched = set()
+                written = set()
+
+    def _run_polling(self):
+        while not self._stop.wait(self.poll_interval):
+            mtime = self._folder_mtime()
+            if mtime == self._dir_mtime:
+                continue
+            self._dir_mtime = mtime
+            names = set(self._list_names())
+            touched = names.symmetric_difference(self.known)
+            if touched:
+                self._flush(touched, set())
+
+    def _flush(self, touched, written):
+        gone = []
+        new = {}
+        changed = []
+        for name in sorted(touched):
+            inode = self._inode(name)
+            if name in self.known:
+                if inode is None:
+                    gone.append(name)
+                elif name in written or inode != self.known[name]:
+                    self.known[name] = inode
+                    changed.append(name)
+            elif inode is not None:
+                new[name] = inode
+        renamed = []
+        by_inode = {inode: name for name, inode in new.items()}
+        for name in list(gone):
+            target = by_inode.get(self.known[name])
+            if target is not None:
+                gone.remove(name)
+                del new[target]
+                renamed.append((name, target))
+        for name in gone:
+            del self.known[name]
+        for old, new_name in renamed:
+            self.known[new_name] = self.known.pop(old)
+        self.known.update(new)
+        if gone or new or renamed or changed:
+            join = lambda item: os.path.join(self.folder, item)
+            self.batches.put({
+                'added': [join(name) for name in sorted(new)],
+                'removed': [join(name) for name in gone],
+                'renamed': [(join(old), join(new_name)) for old, new_name in renamed],
+                'changed': [join(name) for name in changed]
+            })
+
+    def _wanted(self, name):
+        return name.endswith('.mp3') and not name.startswith('.')
+
+    def _list_names(self):
+        try:
+            with os.scandir(self.folder) as entries:
+                return [entry.name for entry in entries if self._wanted(entry.name) and entry.is_file()]
+        except OSError:
+            return []
+
+    def _inode(self, name):
+        try:
+            stat = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            return None
+        return stat.st_ino
+
+    def _folder_mtime(self):
+        try:
+            return os.stat(self.folder).st_mtime_ns
+        except OSError:
+            return None
+
+
+def time_library_scan(folder=MUSIC_DIR, db_path=LIBRARY_INDEX_PATH):
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        cold = LibraryIndex(Path(scratch) / 'library.sqlite3')
+        cold.scan(folder)
+        results['cold'] = dict(cold.last_scan)
+        cold.close()
+    warm = LibraryIndex(db_path)
+    warm.scan(folder)
+    records = warm.scan(folder)
+    results['warm'] = dict(warm.last_scan)
+    warm.close()
+    started = time.perf_counter()
+    playlist = PlaylistStore(record['path'] for record in records)
+    results['playlist'] = dict(playlist.memory_usage(), seconds=time.perf_counter() - started)
+    return results
+
+
+class PlaylistStore:
+    # The sorted playlist as an array of integer track ids. Each path is split into an interned directory
+    # and a bare file name; names and their precomputed sort keys are packed back to back as UTF-8 in one
+    # bytearray (UTF-8 bytes sort in code point order), so a track costs its text plus a few array slots
+    # instead of a Path object, two str headers and a key tuple rebuilt on every comparison.
+    # Ids are never reused: a removed track leaves the order but stays resolvable until the next rebuild.
+    def __init__(self, paths=()):
+        self.dirs = []
+        self.dir_ids = {}
+        self.track_dirs = array.array('I')
+        self.text = bytearray()
+        # Per track: where its name starts and where its key starts; the key runs to the next track's name.
+        self.offsets = array.array('Q')
+        self.order = array.array('I')
+        self.extend(paths)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, position):
+        return Path(self.path(self.order[position]))
+
+    @staticmethod
+    def sort_key(name):
+        dot = name.rfind('.')
+        # Same stem as Path(name).stem, without building a Path.
+        group, stem = stem_sort_key(name[:dot] if 0 < dot < len(name) - 1 else name)
+        # The leading digit orders the same way the group number did in the tuple.
+        return f"{group}{stem}".encode('utf-8', 'surrogatepass')
+
+    def _intern(self, path):
+        cut = path.rfind(os.sep) + 1
+        directory = path[:cut]
+        dir_id = self.dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self.dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        name = path[cut:]
+        text = self.text
+        self.track_dirs.append(dir_id)
+        self.offsets.append(len(text))
+        text += name.encode('utf-8', 'surrogatepass')
+        self.offsets.append(len(text))
+        key = self.sort_key(name)
+        text += key
+        return key, len(self.track_dirs) - 1
+
+    def name(self, track_id):
+        offsets = self.offsets
+        return self.text[offsets[2 * track_id]:offsets[2 * track_id + 1]].decode('utf-8', 'surrogatepass')
+
+    def key(self, track_id):
+        offsets = self.offsets
+        end = 2 * track_id + 2
+        return self.text[offsets[end - 1]:offsets[end] if end < len(offsets) else len(self.text)]
+
+    def path(self, track_id):
+        return self.dirs[self.track_dirs[track_id]] + self.name(track_id)
+
+    def id_at(self, position):
+        return self.order[position]
+
+    def paths(self):
+        path = self.path
+        return (path(track_id) for track_id in self.order)
+
+    def extend(self, paths):
+        added = sorted((self._intern(str(path)) for path in paths), key=lambda item: item[0])
+        if not added:
+            return
+        if not self.order:
+            self.order = array.array('I', (track_id for _key, track_id in added))
+        elif len(added) > 32:
+            self.order = array.array('I', heapq.merge(
+                self.order, (track_id for _key, track_id in added), key=self.key
+            ))
+        else:
+            for key, track_id in added:
+                self.order.insert(bisect.bisect_right(self.order, key, key=self.key), track_id)
+
+    def discard(self, paths):
+        dropped = set()
+        for path in paths:
+            position, found = self.locate(path)
+            if found:
+                dropped.add(self.order[position])
+        if len(dropped) > 32:
+            self.order = array.array('I', (track_id for track_id in self.order if track_id not in dropped))
+        else:
+            for track_id in dropped:
+                position, _found = self.index(track_id)
+                del self.order[position]
+
+    def locate(self, path):
+        path = str(path)
+        return self._probe(self.sort_key(path[path.rfind(os.sep) + 1:]), lambda track_id: self.path(track_id) == path)
+
+    def index(self, track_id):
+        return self._probe(self.key(track_id), lambda candidate: candidate == track_id)
+
+    def _probe(self, key, match):
+        order = self.order
+        position = bisect.bisect_left(order, key, key=self.key)
+        probe = position
+        while probe < len(order) and self.key(order[probe]) == key:
+            if match(order[probe]):
+                return probe, True
+            probe += 1
+        return position, False
+
+    def memory_usage(self):
+        sizeof = sys.getsizeof
+        total = sum(sizeof(directory) for directory in self.dirs) + sum(sizeof(part) for part in (
+            self.dirs, self.dir_ids, self.track_dirs, self.text, self.offsets, self.order
+        ))
+        tracks = len(self.order)
+        return {
+            'tracks': tracks,
+            'directories': len(self.dirs),
+            'bytes': total,
+            'bytes_per_track': total / tracks if tracks else 0.0
+        }
+
+
+class PlayQueue:
+    # Decides what plays after (and before) the current track. Entries are (track_id, position) pairs; the
+    # position is only a hint, re-checked against the store, so queued tracks survive library edits.
+    # Shuffle is a Fisher-Yates pass drawn one step at a time, with displaced slots kept in a dict, so
+    # turning it on or starting a new cycle costs nothing however long the playlist is.
+    REPEAT_MODES = ('all', 'one', 'off')
+    HISTORY = 500
+
+    def __init__(self, songs, rng=None):
+        self.rng = rng if rng is not None else random.Random()
+        self.shuffle = False
+        self.repeat = 'all'
+        self.upnext = collections.deque()
+        self.history = collections.deque(maxlen=self.HISTORY)
+        # Tracks stepped back over with prev(), most recent last; next() returns through them after up-next.
+        self.future = []
+        self._swaps = {}
+        self._drawn = 0
+        self._peeked = None
+        self.reset(songs)
+
+    def reset(self, songs):
+        # A new store hands out new ids, so nothing queued against the old one means anything any more.
+        self.songs = songs
+        self.upnext.clear()
+        self.history.clear()
+        self.future.clear()
+        self.resize()
+
+    def resize(self, position=None):
+        # Positions moved; start a fresh shuffle cycle rather than remapping the old one.
+        self._new_cycle(position)
+
+    def set_shuffle(self, enabled, position=None):
+        self.shuffle = bool(enabled)
+        self._new_cycle(position)
+
+    def set_repeat(self, mode):
+        if mode not in self.REPEAT_MODES:
+            raise ValueError(f"unknown repeat mode {mode!r}")
+        self.repeat = mode
+        self.invalidate()
+
+    def enqueue(self, track_id, position=None, first=False):
+        if first:
+            self.upnext.appendleft((track_id, position))
+        else:
+            self.upnext.append((track_id, position))
+        self.invalidate()
+
+    def jump(self, current):
+        # Picking a track directly: the current one goes into history and the way forward is forgotten.
+        self.invalidate()
+        if current[0] is not None:
+            self.history.append(current)
+        self.future.clear()
+
+    def invalidate(self):
+        peeked = self._peeked
+        self._peeked = None
+        if peeked is not None and peeked[0] == 'shuffle':
+            # Undrawing is just stepping back: the drawn track is still sitting in the slot it was swapped to.
+            self._drawn -= 1
+
+    def peek(self, current, auto=False):
+        if auto and self.repeat == 'one':
+            return current if current[0] is not None else None
+        if self._peeked is None:
+            self._peeked = self._choose(current)
+        return self._peeked[1]
+
+    def advance(self, current, auto=False):
+        entry = self.peek(current, auto)
+        if entry is None or (auto and self.repeat == 'one'):
+            return entry
+        source = self._peeked[0]
+        if source == 'future':
+            self.future.pop()
+        elif source == 'upnext':
+            self.upnext.popleft()
+        elif source == 'shuffle':
+            # Slots below the draw count are never read again.
+            self._swaps.pop(self._drawn - 1, None)
+        self._peeked = None
+        if current[0] is not None:
+            self.history.append(current)
+        return entry
+
+    def back(self, current):
+        self.invalidate()
+        while self.history:
+            entry = self._valid(self.history.pop())
+            if entry is not None:
+                if current[0] is not None:
+                    self.future.append(current)
+                return entry
+        size = len(self.songs)
+        if not size:
+            return None
+        position = ((current[1] or 0) - 1) % size
+        return self.songs.id_at(position), position
+
+    def _valid(self, entry):
+        track_id, position = entry
+        songs = self.songs
+        if position is not None and position < len(songs) and songs.id_at(position) == track_id:
+            return entry
+        position, found = songs.index(track_id)
+        return (track_id, position) if found else None
+
+    def _choose(self, current):
+        upnext = self.upnext
+        while upnext:
+            entry = self._valid(upnext[0])
+            if entry is not None:
+                return 'upnext', entry
+            upnext.popleft()
+        future = self.future
+        while future:
+            entry = self._valid(future[-1])
+            if entry is not None:
+                return 'future', entry
+            future.pop()
+        size = len(self.songs)
+        if not size:
+            return 'end', None
+        position = current[1]
+        if self.shuffle:
+            if self._drawn >= size:
+                if self.repeat == 'off':
+                    return 'end', None
+                self._new_cycle(position)
+            return 'shuffle', self._draw()
+        position = 0 if position is None else position + 1
+        if position >= size:
+            if self.repeat == 'off':
+                return 'end', None
+            position = 0
+        return 'order', (self.songs.id_at(position), position)
+
+    def _new_cycle(self, position):
+        self.invalidate()
+        self._swaps = {}
+        self._drawn = 0
+        if position is not None and len(self.songs) > 1:
+            # The permutation is still the identity, so the current track sits in its own slot: draw it first.
+            if position:
+                self._swaps[0] = position
+                self._swaps[position] = 0
+            self._drawn = 1
+
+    def _draw(self):
+        drawn = self._drawn
+        swaps = self._swaps
+        slot = self.rng.randrange(drawn, len(self.songs))
+        picked = swaps.get(slot, slot)
+        swaps[slot] = swaps.get(drawn, drawn)
+        swaps[drawn] = picked
+        self._drawn = drawn + 1
+        return self.songs.id_at(picked), picked
+
+
+class TrackSearchIndex:
+    # Postings are append-only arrays of doc ids. Removing or re-indexing a track only marks its old doc
+    # dead, and every hit is confirmed against the doc text, so stale postings can never produce a wrong match.
+    PREFIX = '\x00'
+    BLOCK = 1024
+
+    def __init__(self):
+        self.ids = {}
+        self.paths = []
+        self.texts = []
+        self.alive = bytearray()
+        self.postings = {}
+        self.live = 0
+        self.dead = 0
+        self._compacting = None
+        self._compacting_dead = 0
+
+    def __len__(self):
+        return self.live
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(str(text).lower().split())
+
+    @classmethod
+    def document(cls, path, record=None):
+        record = record or {}
+        fields = (record.get('title') or Path(path).stem, record.get('artist'), record.get('album'))
+        # The leading space lets short query words be matched as word prefixes with a plain substring test.
+        return ' ' + cls.normalize(' '.join(field for field in fields if field))
+
+    @classmethod
+    def _keys(cls, word):
+        if len(word) < 3:
+            return {cls.PREFIX + word}
+        return {word[i:i + 3] for i in range(len(word) - 2)}
+
+    @classmethod
+    def _document_keys(cls, text):
+        keys = set()
+        for word in text.split():
+            keys.add(cls.PREFIX + word[:1])
+            keys.add(cls.PREFIX + word[:2])
+            keys.update(word[i:i + 3] for i in range(len(word) - 2))
+        return keys
+
+    def add(self, path, record=None):
+        path = str(path)
+        text = self.document(path, record)
+        doc = self.ids.get(path)
+        if doc is not None:
+            if self.texts[doc] == text:
+                return
+            self._kill(doc)
+        doc = len(self.paths)
+        self.ids[path] = doc
+        self.paths.append(path)
+        self.texts.append(text)
+        self.alive.append(1)
+        postings = self.postings
+        for key in self._document_keys(text):
+            posting = postings.get(key)
+            if posting is None:
+                posting = postings[key] = array.array('I')
+            posting.append(doc)
+        self.live += 1
+
+    def remove(self, path):
+        doc = self.ids.pop(str(path), None)
+        if doc is not None:
+            self._kill(doc)
+
+    def _kill(self, doc):
+        self.paths[doc] = None
+        self.texts[doc] = None
+        self.alive[doc] = 0
+        self.live -= 1
+        self.dead += 1
+
+    @property
+    def needs_compaction(self):
+        return self._compacting is not None or self.dead > max(1024, self.live // 8)
+
+    def compact(self):
+        self.compact_step()
+
+    def compact_step(self, deadline=None):
+        if self._compacting is None:
+            self._compacting = collections.deque(self.postings)
+            self._compacting_dead = self.dead
+        alive = np.frombuffer(self.alive, dtype=np.bool_) if np is not None else self.alive
+        pending = self._compacting
+        while pending:
+            key = pending.popleft()
+            posting = self.postings.get(key)
+            if posting is not None:
+                if np is not None:
+                    docs = np.frombuffer(posting, dtype=np.uintc)
+                    kept = array.array('I', docs[alive[docs]].tobytes())
+                else:
+                    kept = array.array('I', (doc for doc in posting if alive[doc]))
+                if kept:
+                    self.postings[key] = kept
+                else:
+                    del self.postings[key]
+            if deadline is not None and time.perf_counter() >= deadline:
+                return True
+        # Docs killed while this pass was running may still sit in postings it had already visited.
+        self.dead -= self._compacting_dead
+        self._compacting = None
+        return False
+
+    def search(self, query, limit=100):
+        words = self.normalize(query).split()
+        if not words:
+            return []
+        # Only the two rarest keys of each query word: its other trigrams mostly select the same docs,
+        # so intersecting them too buys little, while different words are what actually narrow a query down.
+        postings = {}
+        for word in words:
+            keys = [self.postings.get(key) for key in self._keys(word)]
+            if any(posting is None for posting in keys):
+                return []
+            for posting in sorted(keys, key=len)[:2]:
+                postings[id(posting)] = posting
+        postings = sorted(postings.values(), key=len)
+        needles = [word if len(word) >= 3 else ' ' + word for word in words]
+        results = []
+        if np is None or len(postings) == 1:
+            self._collect(postings[0], needles, results, limit)
+            return results
+        # Walk the rarest posting in doubling blocks, narrowing each block against the other words' postings
+        # (ascending doc ids, so a vectorised binary search) and stopping as soon as the limit is filled.
+        rarest = np.frombuffer(postings[0], dtype=np.uintc)
+        others = [np.frombuffer(posting, dtype=np.uintc) for posting in postings[1:]]
+        start = 0
+        block = self.BLOCK
+        while start < len(rarest):
+            candidates = rarest[start:start + block]
+            for other in others:
+                found = np.minimum(np.searchsorted(other, candidates), len(other) - 1)
+                candidates = candidates[other[found] == candidates]
+                if not len(candidates):
+                    break
+            if self._collect(candidates.tolist(), needles, results, limit):
+                break
+            start += block
+            block *= 2
+        return results
+
+    def _collect(self, candidates, needles, results, limit):
+        texts = self.texts
+        paths = self.paths
+        for doc in candidates:
+            text = texts[doc]
+            if text is not None and all(needle in text for needle in needles):
+                results.append(paths[doc])
+                if len(results) >= limit:
+                    return True
+        return False
+
+
+class PygameAudio:
+    def __init__(self):
+        self.ready = False
+        self.end_events = False
+        self.volume = 1.0
+
+    def init(self):
+        pygame.load()
+        self.ready = True
+        try:
+            # The mixer only posts its end event when SDL's video/event subsystem is up; no window is opened.
+            if not pygame.display.get_init():
+                pygame.display.init()
+            pygame.mixer.music.set_endevent(music_end_event())
+            pygame.event.get(music_end_event())
+            self.end_events = True
+        except Exception:
+            self.end_events = False
+        self.set_volume(self.volume)
+
+    def load(self, source, namehint=None):
+        if namehint:
+            pygame.mixer.music.load(source, namehint)
+        else:
+            pygame.mixer.music.load(str(source))
+
+    def play(self, start=0.0):
+        try:
+            pygame.mixer.music.play(loops=0, start=start)
+        except Exception:
+            pygame.mixer.music.play()
+            try:
+                pygame.mixer.music.set_pos(start)
+            except Exception:
+                pass
+
+    def pause(self):
+        pygame.mixer.music.pause()
+
+    def queue(self, path):
+        pygame.mixer.music.queue(str(path))
+
+    def busy(self):
+        return pygame.mixer.music.get_busy()
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.ready:
+            try:
+                pygame.mixer.music.set_volume(volume)
+            except Exception:
+                pass
+
+    def ended(self):
+        if not self.end_events:
+            return False
+        try:
+            return bool(pygame.event.get(music_end_event()))
+        except Exception:
+            return False
+
+    def discard_end_events(self):
+        if self.end_events:
+            try:
+                pygame.event.clear(music_end_event())
+            except Exception:
+                pass
+
+    def prefetch(self, path):
+        threading.Thread(target=warm_file_cache, args=(path,), name='rei-prefetch', daemon=True).start()
+
+
+class StubAudio:
+    # Mixer stand-in for headless runs: accepts every call, counts them, and ends tracks only when told to.
+    def __init__(self, end_events=True):
+        self.ready = False
+        self.end_events = end_events
+        self.volume = 1.0
+        self.loaded = None
+        self.queued = None
+        self.playing = False
+        self.calls = collections.Counter()
+        self._ended = False
+
+    def init(self):
+        self.ready = True
+
+    def load(self, source, namehint=None):
+        self.calls['load'] += 1
+        self.loaded = source
+        self.queued = None
+        self.playing = False
+
+    def play(self, start=0.0):
+        self.calls['play'] += 1
+        self.playing = self.loaded is not None
+
+    def pause(self):
+        self.calls['pause'] += 1
+        self.playing = False
+
+    def queue(self, path):
+        self.calls['queue'] += 1
+        self.queued = path
+
+    def busy(self):
+        return self.playing
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def ended(self):
+        ended, self._ended = self._ended, False
+        return ended
+
+    def discard_end_events(self):
+        self._ended = False
+
+    def prefetch(self, path):
+        self.calls['prefetch'] += 1
+
+    def finish(self):
+        # What the mixer does when a track runs out: roll onto the queued file, if any, and post the end event.
+        self._ended = self.end_events
+        self.loaded, self.queued = self.queued, None
+        self.playing = self.loaded is not None
+
+
+class PlayerCore:
+    EVENTS = (
+        'track', 'state', 'position', 'duration', 'library', 'metadata', 'queue', 'waveform', 'volume', 'pending',
+        'error'
+    )
+
+    def __init__(
+        self, audio=None, library=None, metadata=None, seek_indexer=None, gapless=True, clock=None, waveforms=None,
+        loudness=None, normalize=True
+    ):
+        self.audio = audio if audio is not None else PygameAudio()
+        self.library = library
+        self.metadata = metadata
+        self.seek_indexer = seek_indexer
+        self.waveforms = waveforms
+        self.loudness = loudness
+        self.normalize = normalize
+        self.gapless = gapless
+        self.clock = clock if clock is not None else PlaybackClock()
+        self.observers = {event: [] for event in self.EVENTS}
+        self.track_info = {}
+        self.songs = PlaylistStore()
+        self.queue = PlayQueue(self.songs)
+        self.idx = 0
+        self.playing = False
+        self.elapsed = 0.0
+        self.duration = 0.0
+        self.seek_index = None
+        self.waveform = None
+        self.track_gain = None
+        self.volume = 100.0
+        self.last_volume = 100.0
+        self.is_muted = False
+        self._queued_id = None
+        self._warmed_id = None
+        self._stream_offset = None
+        self.search_index = TrackSearchIndex()
+        self._unindexed = collections.deque()
+
+    def subscribe(self, event, callback):
+        self.observers[event].append(callback)
+
+    def unsubscribe(self, event, callback):
+        try:
+            self.observers[event].remove(callback)
+        except ValueError:
+            pass
+
+    def _emit(self, event, *args):
+        for callback in list(self.observers[event]):
+            callback(*args)
+
+    @property
+    def current_id(self):
+        return self.songs.id_at(self.idx) if self.songs else None
+
+    @property
+    def current_path(self):
+        return self.songs.path(self.songs.id_at(self.idx)) if self.songs else None
+
+    @property
+    def current(self):
+        return self.songs[self.idx] if self.songs else None
+
+    def start_audio(self):
+        self.audio.init()
+        self._apply_volume()
+
+    def close(self):
+        for service in (self.metadata, self.seek_indexer, self.waveforms, self.loudness):
+            if service is not None:
+                service.shutdown()
+        if self.library is not None:
+            self.library.close()
+
+    def scan(self, folder=MUSIC_DIR):
+        if self.library is None:
+            self.library = LibraryIndex(LIBRARY_INDEX_PATH)
+        self.set_tracks(self.library.scan(folder, probe=None))
+
+    def set_tracks(self, records):
+        self.track_info = {record['path']: record for record in records}
+        self.songs = PlaylistStore(record['path'] for record in records)
+        self.idx = 0
+        # Ids belong to the store they came from.
+        self._queued_id = None
+        self._warmed_id = None
+        self.queue.reset(self.songs)
+        self.search_index = TrackSearchIndex()
+        self._unindexed = collections.deque(self.track_info)
+        self._emit('library', self.songs)
+
+    @property
+    def indexing(self):
+        return bool(self._unindexed) or self.search_index.needs_compaction
+
+    def index_step(self, budget=None):
+        # Builds the search index in slices so a 100k-track library never blocks a frame.
+        deadline = None if budget is None else time.perf_counter() + budget
+        pending = self._unindexed
+        index = self.search_index
+        done = 0
+        while pending:
+            path = pending.popleft()
+            record = self.track_info.get(path)
+            if record is not None and path not in index.ids:
+                index.add(path, record)
+            done += 1
+            if deadline is not None and done % 64 == 0 and time.perf_counter() >= deadline:
+                return True
+        if index.needs_compaction:
+            index.compact_step(deadline)
+        return self.indexing
+
+    def search(self, query, limit=100):
+        return self.search_index.search(query, limit)
+
+    def load_first(self):
+        if not self.songs:
+            return
+        self.load_song(0)
+        if self.metadata is not None:
+            missing = [path for path in self.songs.paths() if self.track_info[path].get('duration') is None]
+            self.metadata.prefetch(missing)
+            self._emit('pending')
+        if self.loudness is not None:
+            # Batch analysis of the whole library, starting with what plays soonest.
+            try:
+                known = self.library.loudness_paths()
+            except Exception:
+                known = set()
+            self.loudness.prefetch([path for path in self.songs.paths() if path not in known])
+            self._emit('pending')
+
+    def _request(self, service, path, priority):
+        if service is None:
+            return
+        service.request(path, priority)
+        self._emit('pending')
+
+    def apply_library_delta(self, batch):
+        current = self.current_path
+        removed = set(batch['removed'])
+        renamed = dict(batch['renamed'])
+        index = self.search_index
+        for old, new in renamed.items():
+            record = self.track_info.pop(old, None)
+            index.remove(old)
+            if record is not None:
+                record['path'] = new
+                self.track_info[new] = record
+                index.add(new, record)
+        for path in removed:
+            self.track_info.pop(path, None)
+            index.remove(path)
+        refreshed = []
+        if self.library is not None:
+            refreshed = self.library.refresh(batch['added'] + batch['changed'])
+            for record in refreshed:
+                self.track_info[record['path']] = record
+                index.add(record['path'], record)
+            self.library.remove(batch['removed'])
+            self.library.rename(batch['renamed'])
+
+        current_renamed = current is not None and current in renamed
+        if current_renamed:
+            current = renamed[current]
+        current_gone = current is not None and current in removed
+        self.songs.discard(removed.union(renamed))
+        self.songs.extend(list(renamed.values()) + batch['added'])
+
+        if not self.songs:
+            self.idx = 0
+        elif current is None:
+            self.load_song(0)
+        else:
+            position, _found = self.song_position(current)
+            # A deleted current track stays loaded in the mixer; park idx just before where it sat so
+            # next() continues with the following song.
+            self.idx = (position - 1 if current_gone else position) % len(self.songs)
+        self.queue.resize(None if current_gone or not self.songs else self.idx)
+        self._emit('library', self.songs)
+        if current_renamed:
+            self._emit('track', Path(current))
+
+        for record in refreshed:
+            self._request(self.metadata, record['path'], MetadataService.BACKGROUND)
+            self._request(self.loudness, record['path'], MetadataService.BACKGROUND)
+
+    def song_position(self, path):
+        return self.songs.locate(path)
+
+    def load_song(self, index):
+        with instruments.timer('core.load_song'):
+            if not self.songs:
+                return
+            self.idx = index % len(self.songs)
+            track_id = self.songs.id_at(self.idx)
+            song_path = self.songs.path(track_id)
+            try:
+                self.audio.load(song_path)
+            except Exception:
+                self._emit('error', "Playback Error", f"Could not load {self.songs.name(track_id)}")
+                return
+            self._queued_id = None
+            self.queue.invalidate()
+            self._stream_offset = None
+            self.audio.discard_end_events()
+            self._use_seek_index(song_path)
+            self._use_duration(song_path)
+            self._use_waveform(song_path)
+            self._use_loudness(song_path)
+            self.elapsed = 0.0
+            self.playing = False
+            self.clock.reset(self.duration)
+            self._emit('track', Path(song_path))
+            self._emit('position', 0.0, self.duration)
+            self._emit('state', False)
+
+    def _use_duration(self, song_path):
+        record = self.track_info.get(str(song_path))
+        if record is not None and record.get('duration') is not None:
+            self.duration = float(record['duration'])
+        else:
+            self.duration = 0.0
+            self._request(self.metadata, song_path, MetadataService.URGENT)
+
+    def _use_seek_index(self, song_path):
+        try:
+            self.seek_index = self.library.seek_index(song_path)
+        except Exception:
+            self.seek_index = None
+        if self.seek_index is None:
+            self._request(self.seek_indexer, song_path, MetadataService.URGENT)
+
+    def _use_waveform(self, song_path):
+        # Only a cache lookup here; a missing waveform is computed out of process and arrives via poll_metadata.
+        try:
+            self.waveform = self.library.waveform(song_path)
+        except Exception:
+            self.waveform = None
+        if self.waveform is None:
+            self._request(self.waveforms, song_path, MetadataService.URGENT)
+        self._emit('waveform', self.waveform)
+
+    def _use_loudness(self, song_path):
+        try:
+            self.track_gain = self.library.loudness(song_path)
+        except Exception:
+            self.track_gain = None
+        if self.track_gain is None:
+            # Plays at the slider's level until the analysis lands in poll_metadata.
+            self._request(self.loudness, song_path, MetadataService.URGENT)
+        self._apply_volume()
+
+    def _apply_volume(self):
+        level = self.volume / 100.0
+        if self.normalize and self.track_gain is not None:
+            # The mixer cannot amplify, so quiet tracks are only raised as far as the slider leaves room.
+            level = min(1.0, level * loudness_factor(self.track_gain['gain'], self.track_gain['peak']))
+        self.audio.set_volume(level)
+
+    def has_pending(self):
+        return any(
+            service is not None and service.has_pending()
+            for service in (self.metadata, self.seek_indexer, self.waveforms, self.loudness)
+        )
+
+    def poll_metadata(self):
+        finished = self.metadata.drain() if self.metadata is not None else []
+        if finished:
+            current = self.current_path
+            for key, info in finished:
+                record = self.track_info.get(key)
+                if record is None or info is None:
+                    continue
+                record.update(info)
+                if key in self.search_index.ids:
+                    self.search_index.add(key, record)
+                if key == current:
+                    self.duration = float(info['duration'] or 0.0)
+                    self.clock.duration = self.duration
+                    self._emit('duration', self.duration)
+            try:
+                self.library.update_metadata([
+                    (key, info) for key, info in finished if info is not None and key in self.track_info
+                ])
+            except Exception:
+                pass
+            self._emit('metadata', [key for key, info in finished if info is not None])
+        built = []
+        if self.seek_indexer is not None:
+            built = [index for _key, index in self.seek_indexer.drain() if index is not None]
+        if built:
+            current = self.current_path
+            for index in built:
+                if index.path == current:
+                    self.seek_index = index
+            try:
+                self.library.store_seek_indexes([index for index in built if index.path in self.track_info])
+            except Exception:
+                pass
+        computed = []
+        if self.waveforms is not None:
+            computed = [(key, info) for key, info in self.waveforms.drain() if info is not None]
+        if computed:
+            current = self.current_path
+            for key, info in computed:
+                if key == current:
+                    self.waveform = info['peaks']
+                    self._emit('waveform', self.waveform)
+            try:
+                self.library.store_waveforms([
+                    (key, info['size'], info['mtime_ns'], info['peaks'])
+                    for key, info in computed if key in self.track_info
+                ])
+            except Exception:
+                pass
+        measured = []
+        if self.loudness is not None:
+            measured = [(key, info) for key, info in self.loudness.drain() if info is not None]
+        if measured:
+            current = self.current_path
+            for key, info in measured:
+                if key == current:
+                    self.track_gain = {'gain': info['gain'], 'peak': info['peak'], 'source': info['source']}
+                    self._apply_volume()
+            try:
+                self.library.store_loudness([
+                    (key, info['size'], info['mtime_ns'], info['gain'], info['peak'], info['source'])
+                    for key, info in measured if key in self.track_info
+                ])
+            except Exception:
+                pass
+        return bool(finished or built or computed or measured)
+
+    def toggle(self):
+        if not self.songs:
+            return
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
+
+    def play(self, start_time=None):
+        with instruments.timer('core.play'):
+            if not self.songs:
+                return
+            if start_time is None:
+                start_time = self.elapsed
+            start_time = max(0.0, min(start_time, self.duration if self.duration else start_time))
+            indexed = self._play_from_seek_index(start_time)
+            if indexed is not None:
+                start_time = indexed
+            else:
+                if self._stream_offset is not None:
+                    # An earlier indexed seek left a mid-file stream loaded; go back to the whole file.
+                    self._reload_current()
+                self.audio.play(start_time)
+            self.audio.discard_end_events()
+            self.clock.start(start_time)
+            self.elapsed = start_time
+            self.playing = True
+            self._apply_volume()
+            self._prepare_gapless()
+            self._emit('state', True)
+
+    def _play_from_seek_index(self, start_time):
+        index = self.seek_index
+        if index is None or start_time <= 0 or not self.songs or index.path != self.current_path:
+            return None
+        try:
+            offset, frame_time = index.locate(start_time)
+            self.audio.load(OffsetFile(index.path, offset), 'mp3')
+            self.audio.play()
+        except Exception:
+            self._reload_current()
+            return None
+        # Loading replaced the mixer queue; _prepare_gapless queues the next track again.
+        self._queued_id = None
+        self._stream_offset = frame_time
+        return frame_time
+
+    def _reload_current(self):
+        self._stream_offset = None
+        self._queued_id = None
+        try:
+            self.audio.load(self.current_path)
+        except Exception:
+            pass
+
+    def pause(self):
+        self.elapsed = self.position()
+        try:
+            self.audio.pause()
+        except Exception:
+            pass
+        self.clock.pause()
+        self.playing = False
+        self._emit('state', False)
+
+    def position(self):
+        if self.clock.running:
+            return self.clock.position()
+        return self.elapsed
+
+    def _queue_entry(self):
+        return (self.songs.id_at(self.idx), self.idx) if self.songs else (None, None)
+
+    def prev(self):
+        self._step(self.queue.back(self._queue_entry()))
+
+    def next(self):
+        self._step(self.queue.advance(self._queue_entry()))
+
+    def _step(self, entry):
+        with instruments.timer('core.step'):
+            if entry is None or not self.songs:
+                return
+            was_playing = self.playing
+            if was_playing:
+                self.pause()
+            self.load_song(entry[1])
+            if was_playing:
+                self.play(0.0)
+
+    def play_track(self, path):
+        position, found = self.songs.locate(path)
+        if not found:
+            return
+        self.queue.jump(self._queue_entry())
+        self.load_song(position)
+        self.play(0.0)
+
+    def enqueue(self, path, first=False):
+        position, found = self.songs.locate(path)
+        if found:
+            self.queue.enqueue(self.songs.id_at(position), position, first)
+            self._requeue()
+
+    def set_shuffle(self, enabled):
+        self.queue.set_shuffle(enabled, self.idx if self.songs else None)
+        self._requeue()
+
+    def toggle_shuffle(self):
+        self.set_shuffle(not self.queue.shuffle)
+
+    def set_repeat(self, mode):
+        self.queue.set_repeat(mode)
+        self._requeue()
+
+    def cycle_repeat(self):
+        modes = PlayQueue.REPEAT_MODES
+        self.set_repeat(modes[(modes.index(self.queue.repeat) + 1) % len(modes)])
+
+    def _requeue(self):
+        # A file already handed to the mixer was picked under the old rules; swap it for the new choice.
+        # If nothing follows any more it stays queued, and _on_track_end simply follows it.
+        upcoming = self._next_song_id()
+        if upcoming is not None and upcoming != self._queued_id:
+            self._queued_id = None
+        if self.playing:
+            self._prepare_gapless()
+        self._emit('queue')
+
+    def scrub(self, position):
+        self.elapsed = max(0.0, min(position, self.duration)) if self.duration > 0 else 0.0
+        self._emit('position', self.elapsed, self.duration)
+
+    def seek(self, position, resume=None):
+        with instruments.timer('core.seek'):
+            if resume is None:
+                resume = self.playing
+            self.play(position)
+            if not resume:
+                self.pause()
+
+    def set_volume(self, value):
+        value = max(0.0, min(100.0, float(value)))
+        if value > 0:
+            self.last_volume = value
+        self.volume = value
+        self.is_muted = value <= 0
+        self._apply_volume()
+        self._emit('volume', value, self.is_muted)
+
+    def set_normalize(self, enabled):
+        self.normalize = bool(enabled)
+        self._apply_volume()
+
+    def toggle_normalize(self):
+        self.set_normalize(not self.normalize)
+
+    def toggle_mute(self):
+        if self.is_muted:
+            self.set_volume(self.last_volume if self.last_volume > 0 else 100.0)
+        else:
+            self.set_volume(0.0)
+
+    def tick(self):
+        if self.audio.ended() and self.playing:
+            self._on_track_end()
+        if self.playing:
+            self.elapsed = self.clock.position()
+            self._maybe_queue_next()
+            if self.duration and self.elapsed >= self.duration - 0.05:
+                try:
+                    busy = self.audio.busy()
+                except Exception:
+                    busy = False
+                if not busy:
+                    self._finish_track()
+
+    def next_tick_delay(self, pixels):
+        if not self.playing:
+            return None
+        wait = self.clock.next_change(pixels) or 1.0
+        remaining = self.clock.remaining()
+        if remaining is not None:
+            if remaining <= 0.05:
+                # The clock has reached the end; keep checking briefly for the mixer's end event.
+                wait = 0.05
+            elif self.gapless and self._queued_id is None and remaining > GAPLESS_QUEUE_LEAD:
+                wait = min(wait, remaining - GAPLESS_QUEUE_LEAD)
+        return wait
+
+    def _finish_track(self):
+        self.playing = False
+        self.elapsed = self.duration
+        self.clock.hold(self.duration)
+        self._emit('state', False)
+
+    def _next_song_id(self):
+        entry = self.queue.peek(self._queue_entry(), auto=True)
+        return entry[0] if entry is not None else None
+
+    def _prepare_gapless(self):
+        if not self.gapless or not self.audio.end_events:
+            return
+        upcoming = self._next_song_id()
+        if upcoming is None:
+            return
+        path = self.songs.path(upcoming)
+        if upcoming != self._warmed_id:
+            self._warmed_id = upcoming
+            self.audio.prefetch(path)
+            try:
+                if self.library.seek_index(path) is None:
+                    self._request(self.seek_indexer, path, MetadataService.AHEAD)
+                if self.waveforms is not None and self.library.waveform(path) is None:
+                    self._request(self.waveforms, path, MetadataService.AHEAD)
+                if self.loudness is not None and self.library.loudness(path) is None:
+                    self._request(self.loudness, path, MetadataService.AHEAD)
+            except Exception:
+                pass
+        record = self.track_info.get(path)
+        if record is not None and record.get('duration') is None:
+            self._request(self.metadata, path, MetadataService.AHEAD)
+        self._maybe_queue_next()
+
+    def _maybe_queue_next(self):
+        if not self.gapless or not self.audio.end_events or not self.playing or self._queued_id is not None:
+            return
+        if self.duration and self.duration - self.elapsed > GAPLESS_QUEUE_LEAD:
+            return
+        upcoming = self._next_song_id()
+        if upcoming is None:
+            return
+        try:
+            self.audio.queue(self.songs.path(upcoming))
+        except Exception:
+            return
+        self._queued_id = upcoming
+
+    def _on_track_end(self):
+        queued = self._queued_id
+        self._queued_id = None
+        if queued is None or not self.playing:
+            self._finish_track()
+            return
+        entry = self.queue.advance(self._queue_entry(), auto=True)
+        if entry is not None and entry[0] == queued:
+            self.idx = entry[1]
+        else:
+            position, found = self.songs.index(queued)
+            if found:
+                self.idx = position
+        path = self.songs.path(queued)
+        self._stream_offset = None
+        self._use_seek_index(path)
+        self._use_duration(path)
+        self._use_waveform(path)
+        self._use_loudness(path)
+        # The end event fires as the mixer switches to the queued track, so that is its zero point.
+        self.elapsed = 0.0
+        self.clock.reset(self.duration)
+        self.clock.start(0.0)
+        self._emit('track', Path(path))
+        self._emit('position', 0.0, self.duration)
+        self._prepare_gapless()
+
+
+class StartupProfile:
+    def __init__(self, started=MODULE_STARTED):
+        self.started = started
+        self.last = started
+        self.phases = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = ["startup phase      ms"]
+        for name, seconds in self.phases:
+            lines.append(f"{name:<14}{seconds * 1000.0:8.1f}")
+        lines.append(f"{'total':<14}{(self.last - self.started) * 1000.0:8.1f}")
+        return "\n".join(lines)
+
+
+class PlaylistPanel:
+    ROW_HEIGHT = 18
+    SEARCH_LIMIT = 200
+
+    def __init__(self, master, core, on_activate, width=360, rows=22):
+        self.core = core
+        self.on_activate = on_activate
+        self.window = tk.Toplevel(master)
+        self.window.title("Playlist")
+        self.window.minsize(240, self.ROW_HEIGHT * 6)
+        self.query_var = tk.StringVar()
+        self.entry = tk.Entry(self.window, textvariable=self.query_var, relief='flat', font=("Arial", 10))
+        self.entry.pack(fill='x', padx=6, pady=(6, 2))
+        self.status = tk.Label(self.window, anchor='w', font=("Arial", 8))
+        self.status.pack(fill='x', padx=6)
+        self.body = tk.Frame(self.window)
+        self.body.pack(fill='both', expand=True, padx=6, pady=(2, 6))
+        self.canvas = tk.Canvas(
+            self.body, width=width, height=rows * self.ROW_HEIGHT, highlightthickness=0, bd=0
+        )
+        self.scrollbar = tk.Scrollbar(self.body, orient='vertical', command=self._on_scrollbar)
+        self.scrollbar.pack(side='right', fill='y')
+        self.canvas.pack(side='left', fill='both', expand=True)
+        self.highlight = self.canvas.create_rectangle(0, 0, 0, 0, outline='', state='hidden')
+        # A fixed pool of text items, one per visible row; scrolling only re-labels them.
+        self.items = []
+        self.shown = []
+        self.rows = 0
+        self.top = 0
+        self.results = None
+        self.search_ms = 0.0
+        self._ensure_rows(rows)
+        self.entry.bind('<KeyRelease>', self._on_query)
+        self.entry.bind('<Return>', self._on_return)
+        self.entry.bind('<Shift-Return>', self._on_shift_return)
+        self.canvas.bind('<Configure>', self._on_resize)
+        self.canvas.bind('<MouseWheel>', self._on_wheel)
+        self.canvas.bind('<Button-4>', lambda _e: self.scroll(-3))
+        self.canvas.bind('<Button-5>', lambda _e: self.scroll(3))
+        self.canvas.bind('<Double-Button-1>', self._on_double_click)
+        self.canvas.bind('<Shift-Double-Button-1>', self._on_shift_double_click)
+        self.window.bind('<Prior>', lambda _e: self.scroll(-self.rows))
+        self.window.bind('<Next>', lambda _e: self.scroll(self.rows))
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+        self.apply_theme()
+        self.entry.focus_set()
+        self.refresh()
+
+    def is_open(self):
+        try:
+            return bool(self.window.winfo_exists())
+        except tk.TclError:
+            return False
+
+    def close(self):
+        try:
+            self.window.destroy()
+        except tk.TclError:
+            pass
+
+    def apply_theme(self, style=None):
+        style = style or (lambda widget, **options: widget.configure(**options))
+        colors = COLORS
+        for widget in (self.window, self.body, self.canvas):
+            style(widget, bg=colors['bg'])
+        style(self.status, bg=colors['bg'], fg=colors['text'])
+        style(self.entry, bg=colors['light'], fg=colors['text'], insertbackground=colors['text'])
+        self.canvas.itemconfigure(self.highlight, fill=colors['slider_trough'])
+        for item in self.items:
+            self.canvas.itemconfigure(item, fill=colors['text'])
+
+    def _ensure_rows(self, rows):
+        rows = max(1, rows)
+        while len(self.items) < rows:
+            row = len(self.items)
+            self.items.append(self.canvas.create_text(
+                6, row * self.ROW_HEIGHT + self.ROW_HEIGHT // 2, anchor='w', font=("Arial", 9), fill=COLORS['text']
+            ))
+            self.shown.append(None)
+        self.rows = rows
+
+    def count(self):
+        return len(self.results) if self.results is not None else len(self.core.songs)
+
+    def path_at(self, row):
+        if self.results is not None:
+            return self.results[row]
+        songs = self.core.songs
+        return songs.path(songs.id_at(row))
+
+    def label(self, path):
+        record = self.core.track_info.get(path) or {}
+        title = record.get('title') or os.path.splitext(os.path.basename(path))[0]
+        artist = record.get('artist')
+        return f"{title}  ·  {artist}" if artist else title
+
+    def scroll(self, rows):
+        self.top = max(0, min(self.top + rows, self.count() - self.rows))
+        self.render()
+
+    def render(self):
+        count = self.count()
+        self.top = max(0, min(self.top, count - self.rows))
+        canvas = self.canvas
+        for slot, item in enumerate(self.items):
+            row = self.top + slot
+            text = self.label(self.path_at(row)) if slot < self.rows and row < count else ''
+            if text != self.shown[slot]:
+                canvas.itemconfigure(item, text=text)
+                self.shown[slot] = text
+        current = self._current_row()
+        if current is not None and self.top <= current < self.top + self.rows:
+            y = (current - self.top) * self.ROW_HEIGHT
+            canvas.coords(self.highlight, 0, y, canvas.winfo_width(), y + self.ROW_HEIGHT)
+            canvas.itemconfigure(self.highlight, state='normal')
+        else:
+            canvas.itemconfigure(self.highlight, state='hidden')
+        if count:
+            self.scrollbar.set(self.top / count, min(1.0, (self.top + self.rows) / count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.update_status()
+
+    def _current_row(self):
+        current = self.core.current_path
+        if current is None:
+            return None
+        if self.results is None:
+            return self.core.idx
+        try:
+            return self.results.index(current)
+        except ValueError:
+            return None
+
+    def update_status(self):
+        total = len(self.core.songs)
+        if self.results is None:
+            text = f"{total} tracks"
+        else:
+            more = '+' if len(self.results) >= self.SEARCH_LIMIT else ''
+            text = f"{len(self.results)}{more} of {total} tracks ({self.search_ms:.2f} ms)"
+        queue = self.core.queue
+        modes = [] if queue.repeat == 'all' else [f"repeat {queue.repeat}"]
+        if queue.shuffle:
+            modes.insert(0, "shuffle")
+        if queue.upnext:
+            modes.append(f"{len(queue.upnext)} up next")
+        if modes:
+            text += "  · " + ", ".join(modes)
+        if self.core.indexing:
+            text += f"  · indexing {len(self.core.search_index)}/{total}"
+        if self.status.cget('text') != text:
+            self.status.configure(text=text)
+
+    def refresh(self):
+        self._search()
+        self.render()
+
+    def _search(self):
+        query = self.query_var.get()
+        if not query.strip():
+            self.results = None
+            return
+        started = time.perf_counter()
+        results = self.core.search(query, self.SEARCH_LIMIT)
+        elapsed = time.perf_counter() - started
+        instruments.record('playlist.search', elapsed)
+        self.search_ms = elapsed * 1000.0
+        results.sort(key=song_sort_key)
+        self.results = results
+
+    def _on_query(self, _event=None):
+        previous = self.results
+        self._search()
+        if self.results != previous:
+            self.top = 0
+            self.render()
+
+    def _on_return(self, _event=None):
+        if self.count():
+            self.on_activate(self.path_at(self.top))
+
+    def _on_shift_return(self, _event=None):
+        if self.count():
+            self.core.enqueue(self.path_at(self.top), first=True)
+        return 'break'
+
+    def _on_resize(self, event):
+        self._ensure_rows(event.height // self.ROW_HEIGHT)
+        self.render()
+
+    def _on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.top = int(float(amount) * self.count())
+            self.render()
+        elif action == 'scroll':
+            self.scroll(int(amount) * (self.rows if unit == 'pages' else 1))
+
+    def _on_double_click(self, event):
+        row = self.top + int(event.y // self.ROW_HEIGHT)
+        if row < self.count():
+            self.on_activate(self.path_at(row))
+
+    def _on_shift_double_click(self, event):
+        row = self.top + int(event.y // self.ROW_HEIGHT)
+        if row < self.count():
+            self.core.enqueue(self.path_at(row))
+        return 'break'
+
+
+class MiffyPlayer:
+    def __init__(self, root, gapless=True, render_thread=False, profile=None, normalize=True):
+        self.root = root
+        self.profile = profile
+        self.root.title("REI Music Player")
+        self.theme = 'light'
+        self.light_mode_icon = None
+        self.dark_mode_icon = None
+        self.theme_button = None
+        self.bg_widgets = []
+        self.text_widgets = []
+        self.button_widgets = []
+        self.header_frame = None
+        self.main_frame = None
+        self.progress_frame = None
+        self.left_fill = None
+        self.spacer = None
+        self.button_frame = None
+        self.volume_frame = None
+        self.vol_slider_holder = None
+        self.canvas = None
+        self.progress_slider = None
+        self.vol_slider = None
+        self.progress_deco_label = None
+        self._theme_animation = None
+        self.styler = WidgetStyler()
+        self.theme_stats = {'transitions': 0, 'last_transition_calls': 0, 'last_transition_requested': 0}
+        self.canvas_size = CANVAS_SIZE
+        width = max(420, self.canvas_size[0] + 120)
+        height = self.canvas_size[1] + 380
+        self.root.geometry(f"{width}x{height}")
+        self.root.resizable(False, False)
+        self.root.configure(bg=COLORS['bg'])
+        self.scene = SakuraScene(self.canvas_size)
+        self._scene_photo = None
+        self._scene_photo_source = None
+        self._scene_version = None
+        self._scene_item = None
+        self.render_worker = SceneRenderWorker(self.scene) if render_thread else None
+        self._stats_item = None
+        self._instruments_item = None
+        self.render_stats = {
+            'frames': 0,
+            'skipped': 0,
+            'pastes': 0,
+            'allocations': 0,
+            'tk_calls': 0,
+            'last_blit_ms': 0.0,
+            'blit_ms_total': 0.0,
+            'last_render_ms': 0.0,
+            'render_ms_total': 0.0
+        }
+
+        self.core = PlayerCore(
+            metadata=MetadataService(),
+            seek_indexer=MetadataService(workers=1, probe=build_seek_index),
+            waveforms=WaveformService(),
+            loudness=LoudnessService(),
+            gapless=gapless,
+            normalize=normalize
+        )
+        self.watcher = None
+        self.playlist_panel = None
+        self.scrubbing = False
+        self.was_playing_before_seek = False
+        self.scheduler = FrameScheduler(self.root, fps=60)
+        self._shown_pixel = None
+        self._time_text = None
+        self.last_anim_tick = time.perf_counter()
+
+        self._suppress_vol_callback = False
+
+        self.play_img = None
+        self.pause_img = None
+
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.load_assets()
+        self._mark('assets')
+        self._bind_core()
+        self.setup_ui()
+        self._refresh_theme_ui(refresh_scene=False)
+        self._register_tasks()
+        if self.render_worker is not None:
+            self.render_worker.start()
+        self.root.bind('<F2>', self.toggle_render_stats)
+        self.root.bind('<F3>', self.toggle_instruments)
+        self.root.bind('<F4>', self.toggle_playlist)
+        self.root.bind('<F5>', lambda _e: self.core.toggle_shuffle())
+        self.root.bind('<F6>', lambda _e: self.core.cycle_repeat())
+        self.root.bind('<F7>', lambda _e: self.core.toggle_normalize())
+        self._register_instrument_sources()
+        self._mark('ui')
+        # Window and static scene first; audio, the library scan and the first track follow one per idle slot.
+        self._startup_stages = collections.deque([
+            ('first frame', self.root.update_idletasks),
+            ('audio', self._init_audio),
+            ('scan', self.load_music),
+            ('first song', self._load_first_song)
+        ])
+        self.root.after_idle(self._run_startup_stage)
+
+    def _mark(self, name):
+        if self.profile is not None:
+            self.profile.mark(name)
+
+    def _run_startup_stage(self):
+        name, stage = self._startup_stages.popleft()
+        try:
+            stage()
+        except Exception:
+            pass
+        self._mark(name)
+        if self._startup_stages:
+            self.root.after(1, self._run_startup_stage)
+        elif self.profile is not None:
+            print(self.profile.report(), flush=True)
+
+    def _init_audio(self):
+        self.core.start_audio()
+
+    def _bind_core(self):
+        core = self.core
+        core.subscribe('track', self._on_core_track)
+        core.subscribe('state', self._on_core_state)
+        core.subscribe('position', self._on_core_position)
+        core.subscribe('duration', self._on_core_duration)
+        core.subscribe('library', self._on_core_library)
+        core.subscribe('metadata', self._on_core_metadata)
+        core.subscribe('queue', self._on_core_queue)
+        core.subscribe('waveform', self._on_core_waveform)
+        core.subscribe('volume', self._on_core_volume)
+        core.subscribe('pending', self._schedule_metadata_poll)
+        core.subscribe('error', messagebox.showerror)
+
+    def _on_core_track(self, path):
+        self.title_label.config(text=path.stem)
+        self.update_time()
+        if self._playlist_open():
+            self.playlist_panel.render()
+
+    def _on_core_state(self, playing):
+        if playing:
+            self._schedule_display_tick()
+        else:
+            self._cancel_display_tick()
+            self._push_progress()
+        if not self.scrubbing:
+            self._update_play_button()
+
+    def _on_core_position(self, elapsed, duration):
+        self._set_progress(elapsed / duration if duration > 0 else 0.0)
+        self.update_time()
+
+    def _on_core_duration(self, _duration):
+        self.update_time()
+        self._schedule_display_tick()
+
+    def _on_core_library(self, songs):
+        if not songs:
+            self.title_label.config(text="Add MP3s to the music folder")
+        if self.core.indexing:
+            self.scheduler.wake('search_index', 0.25)
+        if self._playlist_open():
+            self.playlist_panel.refresh()
+
+    def _on_core_metadata(self, _keys):
+        if self.core.indexing and not self.scheduler.is_awake('search_index'):
+            self.scheduler.wake('search_index', 0.25)
+        if self._playlist_open():
+            self.playlist_panel.render()
+
+    def _on_core_waveform(self, peaks):
+        if self.progress_slider:
+            self.progress_slider.set_peaks(peaks)
+
+    def _on_core_queue(self):
+        if self._playlist_open():
+            self.playlist_panel.update_status()
+
+    def _on_core_volume(self, volume, _muted):
+        if float(self.vol_var.get()) != volume:
+            self._suppress_vol_callback = True
+            self.vol_var.set(volume)
+            self.vol_slider.set(volume)
+            self._suppress_vol_callback = False
+        self._update_volume_button()
+        self._update_volume_heart_position()
+
+    def _register_tasks(self):
+        scheduler = self.scheduler
+        scheduler.add('playback', self.update_display, FrameScheduler.AUDIO, budget=0.002, start=False)
+        scheduler.add('progress', self._push_progress, FrameScheduler.SLIDER, budget=0.002, start=False)
+        scheduler.add('scene', self.animate, FrameScheduler.SCENE, interval=0.033, budget=0.012)
+        scheduler.add('theme', self._step_theme_animation, FrameScheduler.DECORATION, interval=0.016, budget=0.006, start=False)
+        scheduler.add('metadata', self._poll_metadata, FrameScheduler.DECORATION, budget=0.004, start=False)
+        scheduler.add('watcher', self._poll_watcher, FrameScheduler.DECORATION, interval=0.5, budget=0.004, start=False)
+        scheduler.add('search_index', self._index_library, FrameScheduler.DECORATION, budget=0.006, start=False)
+        scheduler.add('instruments', self._report_instruments, FrameScheduler.DECORATION, interval=1.0, budget=0.004,
+                      start=instruments.log is not None)
+
+
+    def on_close(self):
+        self.scheduler.stop()
+        instruments.write_log()
+        instruments.close_log()
+        if self.render_worker is not None:
+            self.render_worker.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.core.close()
+        self.root.destroy()
+
+    def load_assets(self):
+        sprites = AssetAtlas().load()
+        for key, _folder, _filename, _size in UI_SPRITES:
+            setattr(self, key, self._load_photo(sprites.get(key)))
+        self.vol_heart_img = None
+        self.vol_heart_label = None
+        self.vol_heart_item = None
+
+    def _load_photo(self, img):
+        try:
+            return ImageTk.PhotoImage(img) if img is not None else None
+        except Exception:
+            return None
+
+    def setup_ui(self):
+        self.main_frame = tk.Frame(self.root, bg=COLORS['bg'])
+        self.main_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=10)
+        main_frame = self.main_frame
+
+        self.header_frame = tk.Frame(main_frame, bg=COLORS['bg'])
+        self.header_frame.pack(fill=tk.X, pady=(0, 2))
+
+        if self.dark_mode_icon or self.light_mode_icon:
+            initial_icon = self.dark_mode_icon if self.theme == 'light' and self.dark_mode_icon else self.light_mode_icon
+            self.theme_button = tk.Label(
+                self.header_frame,
+                image=initial_icon,
+                bg=COLORS['bg'],
+                cursor='hand2',
+                bd=0,
+                highlightthickness=0
+            )
+            if initial_icon:
+                self.theme_button.image = initial_icon
+            else:
+                self.theme_button.config(text='🌙', fg=COLORS['text'])
+            self.theme_button.pack(side=tk.RIGHT)
+            self.theme_button.bind('<Button-1>', self.toggle_theme)
+        else:
+            self.theme_button = tk.Label(
+                self.header_frame,
+                text='🌙',
+                bg=COLORS['bg'],
+                fg=COLORS['text'],
+                cursor='hand2'
+            )
+            self.theme_button.pack(side=tk.RIGHT)
+            self.theme_button.bind('<Button-1>', self.toggle_theme)
+
+        self.canvas = tk.Canvas(
+            main_frame,
+            width=self.canvas_size[0],
+            height=self.canvas_size[1],
+            bg=COLORS['bg'],
+            highlightthickness=0
+        )
+        self.canvas.pack(pady=(0, 8))
+
+        self.title_label = tk.Label(
             main_frame,
             text="No song",
             font=("Arial", 11, 'bold'),
@@ -780,7 +4371,9 @@ class MiffyPlayer:
             knob_image=self.progress_knob_img,
             knob_width=None,
             knob_height=None,
-            knob_offset=18.0
+            knob_offset=18.0,
+            waveform_color=COLORS['waveform'],
+            waveform_height=22
         )
         self.progress_slider.pack(side=tk.LEFT, fill=tk.X, expand=True)
         self.progress_slider.bind('<Button-1>', self.on_seek_start, add='+')
@@ -898,7 +4491,7 @@ class MiffyPlayer:
         self.button_widgets = [self.back_btn, self.play_btn, self.next_btn, self.vol_btn]
 
         self.vol_heart_item = None
-        self._apply_volume(self.vol_var.get())
+        self.core.set_volume(self.vol_var.get())
         self._update_play_button()
         self._update_volume_button()
         self.root.after(200, self._update_volume_heart_position)
@@ -912,12 +4505,7 @@ class MiffyPlayer:
         if animate:
             self._start_theme_animation(mode, theme_map, refresh_scene)
             return
-        if self._theme_animation_id is not None:
-            try:
-                self.root.after_cancel(self._theme_animation_id)
-            except Exception:
-                pass
-            self._theme_animation_id = None
+        self.scheduler.sleep('theme')
         self._theme_animation = None
         self.theme = mode
         COLORS.clear()
@@ -925,229 +4513,166 @@ class MiffyPlayer:
         self._refresh_theme_ui(refresh_scene=refresh_scene)
 
     def _start_theme_animation(self, mode, theme_map, refresh_scene):
-        if self._theme_animation_id is not None:
-            try:
-                self.root.after_cancel(self._theme_animation_id)
-            except Exception:
-                pass
-            self._theme_animation_id = None
-        start_colors = {key: hex_to_rgb(COLORS.get(key, theme_map.get(key, '#000000'))) for key in theme_map}
-        target_colors = {key: hex_to_rgb(theme_map[key]) for key in theme_map}
+        self.scheduler.sleep('theme')
         self._theme_animation = {
-            'start_time': time.perf_counter(),
-            'duration': 0.45,
-            'start_colors': start_colors,
-            'target_colors': target_colors,
-            'target_map': theme_map,
-            'refresh_scene': refresh_scene
+            'transition': ThemeTransition(COLORS, theme_map),
+            'shown': None,
+            'refresh_scene': refresh_scene,
+            'calls_before': self.styler.calls,
+            'requested_before': self.styler.requested
         }
         self.theme = mode
-        self._step_theme_animation()
+        if self._step_theme_animation() is not False:
+            self.scheduler.wake('theme', 0.016)
 
     def _step_theme_animation(self):
         data = self._theme_animation
         if not data:
-            return
-        elapsed = time.perf_counter() - data['start_time']
-        duration = max(0.05, data.get('duration', 0.3))
-        progress = max(0.0, min(1.0, elapsed / duration))
-        eased = progress * progress * (3.0 - 2.0 * progress)
-        for key, target_rgb in data['target_colors'].items():
-            start_rgb = data['start_colors'].get(key, target_rgb)
-            mixed = tuple(start_rgb[i] + (target_rgb[i] - start_rgb[i]) * eased for i in range(3))
-            COLORS[key] = rgb_to_hex(mixed)
-        self._refresh_theme_ui(refresh_scene=False)
-        if progress >= 1.0:
+            return False
+        transition = data['transition']
+        number, done = transition.frame()
+        if number != data['shown']:
+            data['shown'] = number
+            COLORS.update(transition.palettes[number])
+            self._refresh_theme_ui(refresh_scene=False)
+        if done:
             COLORS.clear()
-            COLORS.update(data['target_map'])
+            COLORS.update(transition.target_map)
             self._refresh_theme_ui(refresh_scene=data['refresh_scene'])
+            self.theme_stats['transitions'] += 1
+            self.theme_stats['last_transition_calls'] = self.styler.calls - data['calls_before']
+            self.theme_stats['last_transition_requested'] = self.styler.requested - data['requested_before']
             self._theme_animation = None
-            self._theme_animation_id = None
-            return
-        self._theme_animation_id = self.root.after(16, self._step_theme_animation)
+            return False
+        return None
 
     def _refresh_theme_ui(self, refresh_scene=True):
         colors = COLORS
-        self.root.configure(bg=colors['bg'])
+        style = self.styler.configure
+        style(self.root, bg=colors['bg'])
         for widget in getattr(self, 'bg_widgets', []):
-            if widget is not None:
-                try:
-                    widget.configure(bg=colors['bg'])
-                except Exception:
-                    pass
+            style(widget, bg=colors['bg'])
         for label in getattr(self, 'text_widgets', []):
-            if label is not None:
-                try:
-                    label.configure(bg=colors['bg'], fg=colors['text'])
-                except Exception:
-                    pass
+            style(label, bg=colors['bg'], fg=colors['text'])
         for btn in getattr(self, 'button_widgets', []):
-            if btn is not None:
-                try:
-                    btn.configure(bg=colors['bg'])
-                    if not getattr(btn, 'image', None):
-                        btn.configure(fg=colors['text'])
-                except Exception:
-                    pass
+            if btn is None:
+                continue
+            if getattr(btn, 'image', None):
+                style(btn, bg=colors['bg'])
+            else:
+                style(btn, bg=colors['bg'], fg=colors['text'])
 
         if self.theme_button:
-            try:
-                self.theme_button.configure(bg=colors['bg'])
-                icon = self.light_mode_icon if self.theme == 'dark' else self.dark_mode_icon
-                if icon:
-                    self.theme_button.configure(image=icon, text='')
-                    self.theme_button.image = icon
-                else:
-                    self.theme_button.configure(
-                        text='☀️' if self.theme == 'dark' else '🌙',
-                        fg=colors['text']
-                    )
-            except Exception:
-                pass
-
-        if self.progress_deco_label:
-            try:
-                self.progress_deco_label.configure(bg=colors['bg'])
-            except Exception:
-                pass
-
-        if self.canvas:
-            try:
-                self.canvas.configure(bg=colors['bg'])
-            except Exception:
-                pass
+            icon = self.light_mode_icon if self.theme == 'dark' else self.dark_mode_icon
+            if icon:
+                style(self.theme_button, bg=colors['bg'], image=icon, text='')
+                self.theme_button.image = icon
+            else:
+                style(
+                    self.theme_button,
+                    bg=colors['bg'],
+                    text='☀️' if self.theme == 'dark' else '🌙',
+                    fg=colors['text']
+                )
 
         if self.progress_slider:
-            self.progress_slider.apply_theme(
+            self.styler.calls += self.progress_slider.apply_theme(
                 bg=colors['bg'],
                 trough=colors['slider_trough'],
                 knob=colors['dark'],
                 active=colors['slider_active'],
-                outline=colors['text']
+                outline=colors['text'],
+                waveform=colors['waveform']
             )
         if self.vol_slider:
-            self.vol_slider.apply_theme(
+            self.styler.calls += self.vol_slider.apply_theme(
                 bg=colors['bg'],
                 trough=colors['slider_trough'],
                 outline=colors['text']
             )
 
+        if self._playlist_open():
+            self.playlist_panel.apply_theme(style)
+
         if refresh_scene:
             self.scene = SakuraScene(self.canvas_size)
-            self._scene_photo = None
             self._scene_photo_source = None
+            if self.render_worker is not None:
+                self.render_worker.scene = self.scene
 
     def load_music(self):
         try:
-            music_dir = Path(__file__).parent / 'music'
-            files = list(music_dir.glob('*.mp3'))
-
-            def _song_priority(path):
-                name = path.stem.lower()
-                if "cruel" in name and "angel" in name:
-                    return (0, name)
-                if "komm" in name and "susser" in name:
-                    return (1, name)
-                return (2, name)
-
-            self.songs = sorted(files, key=_song_priority)
-            if self.songs:
-                self.load_song(0)
-            else:
-                self.title_label.config(text="Add MP3s to the music folder")
+            self.core.scan(MUSIC_DIR)
         except Exception:
-            self.songs = []
+            self.core.set_tracks([])
 
-    def load_song(self, index):
-        if not self.songs:
-            return
-        self.idx = index % len(self.songs)
-        song_path = self.songs[self.idx]
-        try:
-            pygame.mixer.music.load(str(song_path))
-        except Exception:
-            messagebox.showerror("Playback Error", f"Could not load {song_path.name}")
-            return
+    def _load_first_song(self):
         try:
-            audio = MP3(song_path)
-            self.duration = float(audio.info.length)
+            self.core.load_first()
         except Exception:
-            self.duration = 0.0
-        self.elapsed = 0.0
-        self.playing = False
-        self.play_start_offset = 0.0
-        self.play_start_monotonic = 0.0
-        self.progress_var.set(0.0)
-        self.title_label.config(text=song_path.stem)
-        self.update_time()
-        self._update_play_button()
+            pass
+        self._start_watcher()
 
-    def toggle_play(self):
-        if not self.songs:
-            messagebox.showwarning("No Songs", "No songs were found in the music folder.")
+    def _start_watcher(self):
+        if self.watcher is not None or not MUSIC_DIR.is_dir():
             return
-        if self.playing:
-            self._pause_playback()
-        else:
-            self._start_playback(self.elapsed)
-        self._update_play_button()
-
-    def _start_playback(self, start_time):
-        start_time = max(0.0, min(start_time, self.duration if self.duration else start_time))
-        try:
-            pygame.mixer.music.play(loops=0, start=start_time)
-        except Exception:
-            pygame.mixer.music.play()
+        self.watcher = MusicFolderWatcher(MUSIC_DIR, known_paths=self.core.track_info)
+        self.watcher.start()
+        self.scheduler.wake('watcher', 0.5)
+
+    def _poll_watcher(self):
+        if self.watcher is None:
+            return False
+        for batch in self.watcher.drain():
             try:
-                pygame.mixer.music.set_pos(start_time)
+                self.core.apply_library_delta(batch)
             except Exception:
                 pass
-        self.play_start_offset = start_time
-        self.play_start_monotonic = time.perf_counter()
-        self.playing = True
-        self._apply_volume(self.vol_var.get())
+        return None
 
-    def _pause_playback(self):
-        try:
-            current = self._current_playback_position()
-            if current is not None:
-                self.elapsed = current
-        except Exception:
-            pass
-        try:
-            pygame.mixer.music.pause()
-        except Exception:
-            pass
-        self.playing = False
+    def _schedule_metadata_poll(self):
+        if not self.scheduler.is_awake('metadata'):
+            self.scheduler.wake('metadata', 0.04)
 
-    def prev(self):
-        if not self.songs:
-            return
-        was_playing = self.playing
-        self._pause_playback()
-        self.load_song(self.idx - 1)
-        if was_playing:
-            self._start_playback(0.0)
-        self._update_play_button()
+    def _poll_metadata(self):
+        finished = self.core.poll_metadata()
+        if self.core.has_pending():
+            return 0.04 if finished else 0.12
+        return False
 
-    def next(self):
-        if not self.songs:
+    def _playlist_open(self):
+        return self.playlist_panel is not None and self.playlist_panel.is_open()
+
+    def toggle_playlist(self, _event=None):
+        if self._playlist_open():
+            self.playlist_panel.close()
+            self.playlist_panel = None
+        else:
+            self.playlist_panel = PlaylistPanel(self.root, self.core, self.play_path)
+
+    def play_path(self, path):
+        self.core.play_track(path)
+
+    def _index_library(self):
+        more = self.core.index_step(0.004)
+        if self._playlist_open():
+            if more:
+                self.playlist_panel.update_status()
+            else:
+                self.playlist_panel.refresh()
+        return 0.02 if more else False
+
+    def toggle_play(self):
+        if not self.core.songs:
+            messagebox.showwarning("No Songs", "No songs were found in the music folder.")
             return
-        was_playing = self.playing
-        self._pause_playback()
-        self.load_song(self.idx + 1)
-        if was_playing:
-            self._start_playback(0.0)
-        self._update_play_button()
+        self.core.toggle()
 
-    def _current_playback_position(self):
-        try:
-            pos = pygame.mixer.music.get_pos()
-            if pos < 0:
-                return self.elapsed
-            return self.play_start_offset + (pos / 1000.0)
-        except Exception:
-            return self.elapsed
+    def prev(self):
+        self.core.prev()
+
+    def next(self):
+        self.core.next()
 
     def _slider_ratio_from_event(self, event):
         widget = event.widget
@@ -1160,46 +4685,33 @@ class MiffyPlayer:
             ratio = event.x / width if width else 0.0
         return max(0.0, min(1.0, ratio))
 
-    def _update_elapsed_from_ratio(self, ratio):
-        if self.duration > 0:
-            self.elapsed = ratio * self.duration
-        else:
-            self.elapsed = 0.0
-        self.progress_var.set(ratio * 100.0)
-
     def on_seek_start(self, event):
-        if self.duration <= 0:
+        core = self.core
+        if core.duration <= 0:
             return 'break'
         self.scrubbing = True
-        self.was_playing_before_seek = self.playing
-        if self.playing:
-            self._pause_playback()
-        ratio = self._slider_ratio_from_event(event)
-        self._update_elapsed_from_ratio(ratio)
-        self.update_time()
+        self.was_playing_before_seek = core.playing
+        if core.playing:
+            core.pause()
+        core.scrub(self._slider_ratio_from_event(event) * core.duration)
         return 'break'
 
     def on_seek_drag(self, event):
-        if self.duration <= 0 or not self.scrubbing:
+        if self.core.duration <= 0 or not self.scrubbing:
             return 'break'
-        ratio = self._slider_ratio_from_event(event)
-        self._update_elapsed_from_ratio(ratio)
-        self.update_time()
+        self.core.scrub(self._slider_ratio_from_event(event) * self.core.duration)
         return 'break'
 
     def on_seek_end(self, event):
-        if self.duration <= 0:
+        core = self.core
+        if core.duration <= 0:
             self.scrubbing = False
             self.was_playing_before_seek = False
             return 'break'
-        ratio = self._slider_ratio_from_event(event)
-        self._update_elapsed_from_ratio(ratio)
+        core.scrub(self._slider_ratio_from_event(event) * core.duration)
         self.scrubbing = False
-        self._start_playback(self.elapsed)
-        if not self.was_playing_before_seek:
-            self._pause_playback()
+        core.seek(core.elapsed, resume=self.was_playing_before_seek)
         self.was_playing_before_seek = False
-        self.update_time()
         self._update_play_button()
         return 'break'
 
@@ -1210,43 +4722,18 @@ class MiffyPlayer:
             level = float(value)
         except Exception:
             level = float(self.vol_var.get())
-        self._apply_volume(level)
+        self.core.set_volume(level)
 
     def toggle_mute(self):
-        if self.is_muted:
-            restored = self.last_volume if self.last_volume > 0 else 100.0
-            self._set_volume_slider(restored)
-        else:
-            current = self.vol_var.get()
-            if current > 0:
-                self.last_volume = current
-            self._set_volume_slider(0.0)
-
-    def _set_volume_slider(self, value):
-        self._suppress_vol_callback = True
-        self.vol_var.set(value)
-        self.vol_slider.set(value)
-        self._suppress_vol_callback = False
-        self._apply_volume(value)
-
-    def _apply_volume(self, value):
-        value = max(0.0, min(100.0, float(value)))
-        if value > 0:
-            self.last_volume = value
-        try:
-            pygame.mixer.music.set_volume(value / 100.0)
-        except Exception:
-            pass
-        self.is_muted = value <= 0
-        self._update_volume_button()
-        self._update_volume_heart_position()
+        self.core.toggle_mute()
 
     def _update_volume_button(self):
-        img = self.vol_off_img if self.is_muted else self.vol_on_img
+        muted = self.core.is_muted
+        img = self.vol_off_img if muted else self.vol_on_img
         if img:
             self.vol_btn.config(image=img, text="")
         else:
-            self.vol_btn.config(image='', text="OFF" if self.is_muted else "ON")
+            self.vol_btn.config(image='', text="OFF" if muted else "ON")
         self.vol_btn.image = img
 
     def _update_volume_heart_position(self):
@@ -1288,69 +4775,286 @@ class MiffyPlayer:
         slider.tag_raise(heart_item)
 
     def _update_play_button(self):
-        img = self.play_img if self.playing else self.pause_img
+        playing = self.core.playing
+        img = self.play_img if playing else self.pause_img
         if img:
             self.play_btn.config(image=img, text="")
         else:
-            self.play_btn.config(image='', text='>' if self.playing else '||')
+            self.play_btn.config(image='', text='>' if playing else '||')
         self.play_btn.image = img
 
     def update_time(self):
-        elapsed = max(0, int(self.elapsed))
-        total = max(0, int(self.duration))
+        elapsed = max(0, int(self.core.elapsed))
+        total = max(0, int(self.core.duration))
         es = f"{elapsed // 60:02d}:{elapsed % 60:02d}"
         ts = f"{total // 60:02d}:{total % 60:02d}"
-        self.time_label.config(text=f"{es} / {ts}")
+        text = f"{es} / {ts}"
+        if text != self._time_text:
+            self._time_text = text
+            self.time_label.config(text=text)
+            instruments.count('tk.time_label')
 
     def animate(self):
         now = time.perf_counter()
         dt = now - self.last_anim_tick
         self.last_anim_tick = now
+        instruments.record('scene.interval', dt)
         dt = max(0.0, min(dt, 0.12))
-        self.scene.step(dt)
+        worker = self.render_worker
         try:
-            frame = self.scene.render()
-            if self._scene_photo_source is not frame:
-                self._scene_photo_source = frame
-                self._scene_photo = ImageTk.PhotoImage(frame)
-            photo = self._scene_photo
-            if photo:
-                self.canvas.delete('scene')
-                self.canvas.create_image(
-                    self.canvas_size[0] // 2,
-                    self.canvas_size[1] // 2,
-                    image=photo,
-                    tags='scene'
-                )
-                self.canvas.image = photo
+            if worker is not None:
+                frame, sequence = worker.acquire()
+                try:
+                    if frame is not None:
+                        self._blit_scene(frame, sequence)
+                finally:
+                    worker.release()
+            else:
+                started = time.perf_counter()
+                self.scene.step(dt)
+                frame = self.scene.render()
+                instruments.record('scene.render', time.perf_counter() - started)
+                elapsed = (time.perf_counter() - started) * 1000.0
+                self.render_stats['last_render_ms'] = elapsed
+                self.render_stats['render_ms_total'] += elapsed
+                self._blit_scene(frame, getattr(self.scene, 'version', None))
         except Exception:
             pass
-        self.root.after(33, self.animate)
+        if self._stats_item is not None:
+            self._update_render_stats()
+
+    def toggle_render_stats(self, _event=None):
+        if self._stats_item is None:
+            self._stats_item = self.canvas.create_text(
+                6, 6, anchor='nw', font=("Courier", 8), fill='#ffffff', tags='stats'
+            )
+            self._update_render_stats()
+        else:
+            self.canvas.delete(self._stats_item)
+            self._stats_item = None
+
+    def _update_render_stats(self):
+        stats = self.render_stats
+        blits = max(1, stats['frames'] - stats['skipped'])
+        cache = scene_image_cache.stats()
+        if self.render_worker is not None:
+            render = self.render_worker.stats
+            where = 'worker'
+            renders = max(1, render['frames'])
+        else:
+            render = stats
+            where = 'tk'
+            renders = max(1, stats['frames'])
+        text = (
+            f"render {render['last_render_ms']:5.2f} ms (avg {render['render_ms_total'] / renders:5.2f}, {where})\n"
+            f"blit   {stats['last_blit_ms']:5.2f} ms (avg {stats['blit_ms_total'] / blits:5.2f})\n"
+            f"scene cache {cache['hits']} hit / {cache['misses']} miss"
+        )
+        self.canvas.itemconfigure(self._stats_item, text=text)
+        self.canvas.tag_raise(self._stats_item)
+
+    def _register_instrument_sources(self):
+        render_keys = ('frames', 'skipped', 'pastes', 'allocations', 'tk_calls')
+        instruments.add_source('scheduler', lambda: dict(self.scheduler.stats))
+        instruments.add_source('render', lambda: {key: self.render_stats[key] for key in render_keys})
+        instruments.add_source('styler', lambda: {'calls': self.styler.calls, 'requested': self.styler.requested})
+        instruments.add_source('scene_cache', scene_image_cache.stats)
+
+    def toggle_instruments(self, _event=None):
+        if self._instruments_item is None:
+            instruments.enable()
+            self._instruments_item = self.canvas.create_text(
+                6, self.canvas_size[1] - 6, anchor='sw', font=("Courier", 7), fill='#ffffff', tags='instruments'
+            )
+            self.scheduler.wake('instruments')
+        else:
+            self.canvas.delete(self._instruments_item)
+            self._instruments_item = None
+
+    def _report_instruments(self):
+        if self._instruments_item is None and instruments.log is None:
+            return False
+        snapshot = instruments.snapshot()
+        instruments.write_log(snapshot)
+        if self._instruments_item is not None:
+            self.canvas.itemconfigure(self._instruments_item, text=self._format_instruments(snapshot))
+            self.canvas.tag_raise(self._instruments_item)
+        return None
+
+    def _format_instruments(self, snapshot):
+        stages = snapshot['stages']
+        idle = {'count': 0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+        frame = stages.get('frame', idle)
+        lines = [
+            f"frame  p50 {frame['p50_ms']:5.2f} p95 {frame['p95_ms']:5.2f} p99 {frame['p99_ms']:5.2f}",
+            f"render p95 {stages.get('scene.render', idle)['p95_ms']:5.2f} blit p95 {stages.get('scene.blit', idle)['p95_ms']:5.2f}"
+        ]
+        slowest = sorted(
+            (item for item in stages.items() if item[0] not in ('frame', 'scene.interval')),
+            key=lambda item: -item[1]['p99_ms']
+        )[:4]
+        for stage, stats in slowest:
+            lines.append(f"{stage[:16]:<16} p99 {stats['p99_ms']:6.2f} max {stats['max_ms']:6.1f}")
+        counters = snapshot['counters']
+        render = snapshot['sources'].get('render') or {}
+        lines.append(
+            f"tk {render.get('tk_calls', 0) + counters.get('tk.progress', 0) + counters.get('tk.time_label', 0)}"
+            f" photo {render.get('allocations', 0)} styler {self.styler.calls}"
+        )
+        return "\n".join(lines)
+
+    def _blit_scene(self, frame, version=None):
+        stats = self.render_stats
+        stats['frames'] += 1
+        if frame is self._scene_photo_source and version == self._scene_version:
+            stats['skipped'] += 1
+            stats['last_blit_ms'] = 0.0
+            return
+        started = time.perf_counter()
+        photo = self._scene_photo
+        if photo is None or (photo.width(), photo.height()) != frame.size:
+            photo = ImageTk.PhotoImage(frame)
+            self._scene_photo = photo
+            stats['allocations'] += 1
+            instruments.count('photo.allocations')
+            if self._scene_item is not None:
+                self.canvas.itemconfigure(self._scene_item, image=photo)
+                stats['tk_calls'] += 1
+        else:
+            photo.paste(frame)
+            stats['pastes'] += 1
+        stats['tk_calls'] += 1
+        if self._scene_item is None:
+            self._scene_item = self.canvas.create_image(
+                self.canvas_size[0] // 2,
+                self.canvas_size[1] // 2,
+                image=photo,
+                tags='scene'
+            )
+            self.canvas.tag_lower(self._scene_item)
+            stats['tk_calls'] += 2
+        self.canvas.image = photo
+        self._scene_photo_source = frame
+        self._scene_version = version
+        instruments.record('scene.blit', time.perf_counter() - started)
+        elapsed = (time.perf_counter() - started) * 1000.0
+        stats['last_blit_ms'] = elapsed
+        stats['blit_ms_total'] += elapsed
 
     def update_display(self):
-        busy = False
-        try:
-            busy = pygame.mixer.music.get_busy()
-        except Exception:
-            busy = False
-        if self.playing:
-            current = self._current_playback_position()
-            if current is not None:
-                self.elapsed = min(current, self.duration) if self.duration else current
-        if not busy and self.playing and self.duration and self.elapsed >= self.duration - 0.05:
-            self.playing = False
-            self.elapsed = self.duration
-            self._update_play_button()
-        if self.duration > 0 and not self.scrubbing:
-            ratio = max(0.0, min(1.0, self.elapsed / self.duration))
-            self.progress_var.set(ratio * 100.0)
+        self.core.tick()
+        self.scheduler.wake('progress')
+        self._schedule_display_tick()
+
+    def _schedule_display_tick(self):
+        wait = self.core.next_tick_delay(self._progress_pixels())
+        if wait is None:
+            self.scheduler.sleep('playback')
+            return
+        self.scheduler.wake('playback', wait + 0.001)
+
+    def _cancel_display_tick(self):
+        self.scheduler.sleep('playback')
+
+    def _progress_pixels(self):
+        slider = self.progress_slider
+        return max(1, int(round(slider.length))) if slider is not None else 100
+
+    def _set_progress(self, ratio):
+        ratio = max(0.0, min(1.0, ratio))
+        self._shown_pixel = int(round(ratio * self._progress_pixels()))
+        self.progress_var.set(ratio * 100.0)
+        instruments.count('tk.progress')
+
+    def _push_progress(self):
+        core = self.core
+        if core.duration > 0 and not self.scrubbing:
+            ratio = max(0.0, min(1.0, core.elapsed / core.duration))
+            if int(round(ratio * self._progress_pixels())) != self._shown_pixel:
+                self._set_progress(ratio)
         self.update_time()
-        self.root.after(120, self.update_display)
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="REI Music Player")
+    parser.add_argument(
+        '--time-scan',
+        action='store_true',
+        help="time a cold (empty index) and warm library scan of the music folder, then exit"
+    )
+    parser.add_argument(
+        '--build-assets',
+        action='store_true',
+        help="prebake the resized UI sprites into .cache/assets, then exit"
+    )
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help="print how long imports, assets, UI, first frame, audio, library scan and first song took"
+    )
+    parser.add_argument(
+        '--instrument',
+        action='store_true',
+        help="collect frame, task, load/seek and probe timings from the start (F3 shows them)"
+    )
+    parser.add_argument(
+        '--instrument-log',
+        metavar='PATH',
+        help="append an instrumentation snapshot to PATH as one JSON line per second"
+    )
+    parser.add_argument(
+        '--no-gapless',
+        action='store_true',
+        help="stop at the end of each track instead of queueing the next one"
+    )
+    parser.add_argument(
+        '--no-normalize',
+        action='store_true',
+        help="play every track at the slider's level instead of evening out loudness (F7 toggles it too)"
+    )
+    parser.add_argument(
+        '--render-thread',
+        action='store_true',
+        help="render the scene on a background thread and only blit finished frames on the Tk thread"
+    )
+    args = parser.parse_args(argv)
+    if args.time_scan:
+        results = time_library_scan()
+        for label in ('cold', 'warm'):
+            stats = results[label]
+            print(
+                f"{label:>4}: {stats['seconds'] * 1000.0:8.1f} ms  "
+                f"{stats['listed']} tracks, {stats['probed']} probed, {stats['removed']} removed"
+            )
+        stats = results['playlist']
+        print(
+            f"list: {stats['seconds'] * 1000.0:8.1f} ms  {stats['tracks']} tracks in {stats['directories']} folders, "
+            f"{stats['bytes'] / 1024.0:.0f} KiB ({stats['bytes_per_track']:.0f} B/track)"
+        )
+        return
+    if args.build_assets:
+        atlas = AssetAtlas()
+        sprites = atlas.build()
+        print(f"{sum(1 for img in sprites.values() if img is not None)} sprites -> {atlas.atlas_path}")
+        return
+    if args.instrument:
+        instruments.enable()
+    if args.instrument_log:
+        instruments.open_log(args.instrument_log)
+    profile = None
+    if args.profile_startup:
+        profile = StartupProfile()
+        profile.mark('imports')
     root = tk.Tk()
-    MiffyPlayer(root)
+    if profile is not None:
+        profile.mark('tk')
+    MiffyPlayer(
+        root,
+        gapless=not args.no_gapless,
+        render_thread=args.render_thread,
+        profile=profile,
+        normalize=not args.no_normalize
+    )
     root.mainloop()
 
 
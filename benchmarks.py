@@ -0,0 +1,813 @@
+import argparse
+import collections
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+# Benchmarks never play audio; keep pygame's mixer happy on machines without a sound device.
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import REI_music_player as rei
+
+
+MPEG1_L3_BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+
+def write_synthetic_mp3(path, frames=2000, bitrates=MPEG1_L3_BITRATES, seed=0, xing=True):
+    rng = random.Random(seed)
+    chosen = [rng.choice(bitrates) for _ in range(frames)]
+    sizes = [144 * rate * 1000 // 44100 for rate in chosen]
+    header_size = 144 * 128000 // 44100 if xing else 0
+    total = header_size + sum(sizes)
+    with open(path, 'wb') as handle:
+        if xing:
+            toc = bytearray(100)
+            position = header_size
+            marks = []
+            for size in sizes:
+                marks.append(position)
+                position += size
+            for percent in range(100):
+                frame = min(frames - 1, int(percent / 100.0 * frames))
+                toc[percent] = min(255, int(marks[frame] * 256 / total))
+            body = bytearray(header_size)
+            body[0:4] = bytes((0xFF, 0xFB, 0x90, 0x00))
+            body[36:40] = b'Xing'
+            struct.pack_into('>III', body, 40, 0x7, frames, total)
+            body[52:152] = toc
+            handle.write(body)
+        for rate, size in zip(chosen, sizes):
+            index = MPEG1_L3_BITRATES.index(rate) + 1
+            frame = bytearray(size)
+            frame[0:4] = bytes((0xFF, 0xFB, index << 4, 0x00))
+            handle.write(frame)
+    return Path(path)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * (len(ordered) - 1) + 0.5))]
+
+
+def _summary(errors, latencies):
+    return {
+        'error_mean_ms': sum(errors) / len(errors) * 1000.0 if errors else 0.0,
+        'error_p95_ms': _percentile(errors, 0.95) * 1000.0,
+        'error_max_ms': max(errors) * 1000.0 if errors else 0.0,
+        'latency_mean_ms': sum(latencies) / len(latencies) * 1000.0 if latencies else 0.0,
+        'latency_p95_ms': _percentile(latencies, 0.95) * 1000.0
+    }
+
+
+def bench_seek(paths, samples=100, seed=0):
+    rng = random.Random(seed)
+    methods = ('index', 'toc', 'cbr')
+    errors = {method: [] for method in methods}
+    latencies = {method: [] for method in methods}
+    build_times = []
+    files = 0
+    for path in paths:
+        path = str(path)
+        started = time.perf_counter()
+        index = rei.build_seek_index(path)
+        build_times.append(time.perf_counter() - started)
+        if index is None:
+            continue
+        files += 1
+        with open(path, 'rb') as handle:
+            _header, frames, _vbr = rei.scan_mp3_frames(handle.read())
+        frame_at = {offset: number for number, offset in enumerate(frames)}
+        duration = index.duration
+        for _ in range(samples):
+            target = rng.uniform(0.0, duration)
+            for method in methods:
+                started = time.perf_counter()
+                if method == 'index':
+                    offset, _landed = index.locate(target)
+                else:
+                    offset = rei.toc_seek_offset(path, target, duration, use_toc=(method == 'toc'))
+                latencies[method].append(time.perf_counter() - started)
+                number = frame_at.get(offset)
+                if number is None:
+                    continue
+                errors[method].append(abs(number * index.frame_seconds - target))
+    results = {
+        'files': files,
+        'samples_per_file': samples,
+        'index_build_mean_ms': sum(build_times) / len(build_times) * 1000.0 if build_times else 0.0
+    }
+    for method in methods:
+        results[method] = _summary(errors[method], latencies[method])
+    return results
+
+
+def _time_frames(field, frames, dt=1 / 30.0):
+    field.step(dt)
+    field.render()
+    started = time.perf_counter()
+    for _ in range(frames):
+        field.step(dt)
+        field.render()
+    return (time.perf_counter() - started) * 1000.0 / frames
+
+
+def bench_petals(counts=(28, 250, 1000, 2500), frames=60):
+    results = []
+    for count in counts:
+        random.seed(count)
+        row = {'petals': count}
+        engines = [('dict', rei.SakuraPetalField(rei.CANVAS_SIZE, count))]
+        if rei.np is not None:
+            engines.append(('numpy', rei.SakuraPetalArrays(rei.CANVAS_SIZE, count, seed=count)))
+        for name, field in engines:
+            frame_ms = _time_frames(field, frames)
+            row[name] = {'frame_ms': frame_ms, 'petals_per_ms': count / frame_ms}
+        results.append(row)
+    return results
+
+
+def build_gradient_by_rows(size, top_hex, bottom_hex):
+    # The original SakuraBackground._build_base: one draw.line per row.
+    w, h = size
+    img = Image.new('RGBA', (w, h))
+    draw = ImageDraw.Draw(img)
+    top = rei.hex_to_rgb(top_hex)
+    bottom = rei.hex_to_rgb(bottom_hex)
+    for y in range(h):
+        ratio = y / max(1, h - 1)
+        r = int(top[0] * (1 - ratio) + bottom[0] * ratio)
+        g = int(top[1] * (1 - ratio) + bottom[1] * ratio)
+        b = int(top[2] * (1 - ratio) + bottom[2] * ratio)
+        draw.line([(0, y), (w, y)], fill=(r, g, b, 255))
+    return img
+
+
+def bench_gradient(sizes=((240, 306), (480, 612), (1920, 1080)), repeats=50):
+    results = []
+    themes = (rei.LIGHT_THEME, rei.DARK_THEME)
+    for size in sizes:
+        row = {'size': list(size)}
+        for name, build in (('rows', build_gradient_by_rows), ('vectorized', rei.vertical_gradient)):
+            started = time.perf_counter()
+            for number in range(repeats):
+                theme = themes[number % 2]
+                # Shift one channel per call so the vectorised path never hits its own cache here.
+                top = rei.rgb_to_hex(tuple((c + number) % 256 for c in rei.hex_to_rgb(theme['bg_top'])))
+                build(size, top, theme['bg_bottom'])
+            row[name + '_ms'] = (time.perf_counter() - started) * 1000.0 / repeats
+        rei.vertical_gradient(size, rei.LIGHT_THEME['bg_top'], rei.LIGHT_THEME['bg_bottom'])
+        started = time.perf_counter()
+        for _ in range(repeats):
+            rei.vertical_gradient(size, rei.LIGHT_THEME['bg_top'], rei.LIGHT_THEME['bg_bottom'])
+        row['cached_ms'] = (time.perf_counter() - started) * 1000.0 / repeats
+        reference = build_gradient_by_rows(size, rei.LIGHT_THEME['bg_top'], rei.LIGHT_THEME['bg_bottom'])
+        row['identical'] = reference.tobytes() == rei.vertical_gradient(
+            size, rei.LIGHT_THEME['bg_top'], rei.LIGHT_THEME['bg_bottom']).tobytes()
+        results.append(row)
+    return results
+
+
+def bench_assets(repeats=20):
+    root = Path(rei.__file__).parent
+    started = time.perf_counter()
+    for _ in range(repeats):
+        direct = {key: rei.load_sprite(root / folder / filename, size) for key, folder, filename, size in rei.UI_SPRITES}
+    direct_ms = (time.perf_counter() - started) * 1000.0 / repeats
+    with tempfile.TemporaryDirectory() as scratch:
+        atlas = rei.AssetAtlas(cache_dir=scratch)
+        started = time.perf_counter()
+        atlas.load()
+        build_ms = (time.perf_counter() - started) * 1000.0
+        started = time.perf_counter()
+        for _ in range(repeats):
+            cached = atlas.load()
+        cached_ms = (time.perf_counter() - started) * 1000.0 / repeats
+    identical = all(
+        (direct[key] is None and cached[key] is None) or
+        (direct[key] is not None and cached[key] is not None and direct[key].tobytes() == cached[key].tobytes())
+        for key in direct
+    )
+    return {
+        'sprites': sum(1 for img in direct.values() if img is not None),
+        'direct_ms': direct_ms,
+        'atlas_build_ms': build_ms,
+        'atlas_cached_ms': cached_ms,
+        'identical': identical
+    }
+
+
+class _ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def bench_core(tracks=100000, commands=5000, seed=0):
+    rng = random.Random(seed)
+    clock = _ManualClock()
+    audio = rei.StubAudio()
+    core = rei.PlayerCore(audio=audio, clock=rei.PlaybackClock(now=clock))
+    events = collections.Counter()
+    for event in core.EVENTS:
+        core.subscribe(event, lambda *_args, event=event: events.update((event,)))
+    records = [{'path': f'/synthetic/{rng.random():.12f}-{number}.mp3', 'duration': 180.0 + number % 120}
+               for number in range(tracks)]
+    timings = {}
+
+    started = time.perf_counter()
+    core.set_tracks(records)
+    timings['set_tracks_ms'] = (time.perf_counter() - started) * 1000.0
+    core.start_audio()
+    core.load_first()
+    core.play()
+
+    def run(name, action):
+        samples = []
+        for number in range(commands):
+            started = time.perf_counter()
+            action(number)
+            samples.append((time.perf_counter() - started) * 1e6)
+        timings[name] = {'mean_us': sum(samples) / len(samples), 'p99_us': _percentile(samples, 0.99)}
+
+    run('next', lambda _number: core.next())
+    run('prev', lambda _number: core.prev())
+    run('seek', lambda _number: core.seek(rng.uniform(0.0, core.duration)))
+
+    def tick(_number):
+        clock.now += 0.25
+        if core.duration - core.position() < 1.0:
+            audio.finish()
+        core.tick()
+    run('tick', tick)
+    timings['tracks'] = tracks
+    timings['commands'] = commands
+    timings['events'] = dict(events)
+    timings['audio_calls'] = dict(audio.calls)
+    return timings
+
+
+def _allocated(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        return kept, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def bench_playlist(tracks=1000000, folders=2000, seed=0):
+    rng = random.Random(seed)
+    paths = [f'/music/artist {rng.randrange(folders) // 10:04d}/album {rng.randrange(10)}/'
+             f'{rng.randrange(10 ** 9):09d} track {number}.mp3' for number in range(tracks)]
+
+    def path_list():
+        return sorted((Path(path) for path in paths), key=rei.song_sort_key)
+
+    results = {'tracks': tracks}
+    for name, build in (('paths', path_list), ('store', lambda: rei.PlaylistStore(paths))):
+        started = time.perf_counter()
+        playlist = build()
+        seconds = time.perf_counter() - started
+        del playlist
+        _playlist, allocated = _allocated(build)
+        results[name] = {'build_ms': seconds * 1000.0, 'bytes': allocated, 'bytes_per_track': allocated / tracks}
+    store = rei.PlaylistStore(paths)
+    results['store']['report'] = store.memory_usage()
+    samples = []
+    for path in rng.sample(paths, min(tracks, 2000)):
+        started = time.perf_counter()
+        store.locate(path)
+        samples.append((time.perf_counter() - started) * 1e6)
+    results['store']['locate_mean_us'] = sum(samples) / len(samples)
+    return results
+
+
+def bench_queue(tracks=1000000, operations=20000, seed=0):
+    rng = random.Random(seed)
+    songs = rei.PlaylistStore(f'/music/{number:07d}.mp3' for number in range(tracks))
+    queue = rei.PlayQueue(songs, random.Random(seed))
+    current = (songs.id_at(0), 0)
+    results = {'tracks': tracks, 'operations': operations}
+
+    def run(name, action):
+        nonlocal current
+        samples = []
+        for _ in range(operations):
+            started = time.perf_counter()
+            entry = action()
+            samples.append((time.perf_counter() - started) * 1e6)
+            if entry is not None:
+                current = entry
+        results[name] = {'mean_us': sum(samples) / len(samples), 'p99_us': _percentile(samples, 0.99)}
+
+    run('order_next', lambda: queue.advance(current))
+    run('shuffle_on', lambda: queue.set_shuffle(True, current[1]))
+    run('shuffle_next', lambda: queue.advance(current))
+    run('shuffle_peek_auto', lambda: queue.peek(current, auto=True) and None)
+    run('prev', lambda: queue.back(current))
+    run('next_after_prev', lambda: queue.advance(current))
+
+    def enqueue():
+        position = rng.randrange(tracks)
+        queue.enqueue(songs.id_at(position), position)
+    run('enqueue', enqueue)
+    run('upnext_next', lambda: queue.advance(current))
+    results['shuffle_slots_held'] = len(queue._swaps)
+
+    order = list(range(tracks))
+    started = time.perf_counter()
+    random.Random(seed).shuffle(order)
+    results['full_shuffle_ms'] = (time.perf_counter() - started) * 1000.0
+    return results
+
+
+def bench_waveform(files=8, frames=7000, workers=None):
+    results = {'files': files, 'frames_per_file': frames}
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = [str(write_synthetic_mp3(Path(scratch) / f'wave{number:03d}.mp3', frames=frames, seed=number))
+                 for number in range(files)]
+        service = rei.WaveformService(workers=workers)
+        try:
+            started = time.perf_counter()
+            service.request(paths[0])
+            while not service.drain() and time.perf_counter() - started < 60:
+                time.sleep(0.005)
+            results['pool_start_ms'] = (time.perf_counter() - started) * 1000.0
+            started = time.perf_counter()
+            for path in paths:
+                service.request(path)
+            done = []
+            while len(done) < files and time.perf_counter() - started < 300:
+                done.extend(service.drain())
+                time.sleep(0.005)
+            seconds = time.perf_counter() - started
+        finally:
+            service.shutdown()
+        results['processes'] = service.processes
+        results['computed'] = sum(1 for _key, info in done if info is not None)
+        results['tracks_per_second'] = files / seconds if seconds else 0.0
+        peaks = next((info['peaks'] for _key, info in done if info is not None), bytes(2 * rei.WAVEFORM_BUCKETS))
+    results['peaks_bytes'] = len(peaks)
+    results['columns_ms'] = {}
+    for width in (120, 480, 1920):
+        results['columns_ms'][width] = _median_ms(lambda: rei.waveform_columns(peaks, width), 50)
+    return results
+
+
+def _run_service(service, paths, timeout=300):
+    started = time.perf_counter()
+    for path in paths:
+        service.request(path)
+    done = []
+    while len(done) < len(paths) and time.perf_counter() - started < timeout:
+        done.extend(service.drain())
+        time.sleep(0.005)
+    return done, time.perf_counter() - started
+
+
+def bench_loudness(files=8, frames=7000, workers=None, folder=None, seconds=240):
+    from mutagen.id3 import ID3, TXXX
+
+    rate = rei.LOUDNESS_RATE
+    results = {'analysis': {'track_seconds': seconds}}
+    rng = rei.np.random.default_rng(0)
+    track = (rng.standard_normal((rate * seconds, 2)) * 3000).astype(rei.np.int16)
+    analysis_ms = _median_ms(lambda: rei.loudness_lufs(track, rate), 5)
+    results['analysis']['ms_per_track'] = analysis_ms
+    results['analysis']['tracks_per_min_per_core'] = 60000.0 / analysis_ms if analysis_ms else 0.0
+    # A -20 dBFS 997 Hz tone in both channels measures -20 LUFS by definition.
+    tone = rei.np.sin(2 * rei.np.pi * 997.0 * rei.np.arange(rate * 10) / rate) * 0.1 * 32767
+    results['analysis']['tone_lufs'] = rei.loudness_lufs(rei.np.stack([tone, tone], axis=1).astype(rei.np.int16), rate)
+    with tempfile.TemporaryDirectory() as scratch:
+        if folder:
+            paths = [str(path) for path in sorted(Path(folder).glob('*.mp3'))[:files]]
+        else:
+            paths = [str(write_synthetic_mp3(Path(scratch) / f'loud{number:03d}.mp3', frames=frames, seed=number))
+                     for number in range(files)]
+        service = rei.LoudnessService(workers=workers)
+        try:
+            started = time.perf_counter()
+            service.request(paths[0])
+            while not service.drain() and time.perf_counter() - started < 60:
+                time.sleep(0.005)
+            results['pool_start_ms'] = (time.perf_counter() - started) * 1000.0
+            scanned, scan_seconds = _run_service(service, paths)
+            tagged = []
+            for number, path in enumerate(paths):
+                copy = Path(scratch) / f'tagged{number:03d}.mp3'
+                copy.write_bytes(Path(path).read_bytes())
+                tags = ID3()
+                tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_GAIN', text=['-6.20 dB']))
+                tags.add(TXXX(encoding=3, desc='REPLAYGAIN_TRACK_PEAK', text=['0.988']))
+                tags.save(str(copy))
+                tagged.append(str(copy))
+            read, tag_seconds = _run_service(service, tagged)
+        finally:
+            service.shutdown()
+    results['processes'] = service.processes
+    results['files'] = len(paths)
+    for name, done, took in (('scan', scanned, scan_seconds), ('tags', read, tag_seconds)):
+        count = sum(1 for _key, info in done if info is not None)
+        results[name] = {
+            'computed': count,
+            'sources': sorted({info['source'] for _key, info in done if info is not None}),
+            'tracks_per_min_per_core': count / (took / 60.0) / service.processes if took else 0.0
+        }
+    return results
+
+
+SEARCH_WORDS = ('rei', 'asuka', 'shinji', 'misato', 'night', 'sky', 'blue', 'angel', 'kari', 'moon', 'love', 'eva')
+SEARCH_QUERIES = ('r', 'rei', 'rei ange', 'night sky', 'blue kari', 'zzz', 'asuka shinji misato', 'ev lo ve')
+
+
+def bench_search(tracks=100000, repeats=20, seed=0):
+    rng = random.Random(seed)
+    records = [{'path': f'/synthetic/{number:06d}.mp3', 'title': ' '.join(rng.choices(SEARCH_WORDS, k=3)),
+                'artist': rng.choice(SEARCH_WORDS)} for number in range(tracks)]
+    core = rei.PlayerCore(audio=rei.StubAudio())
+    core.set_tracks(records)
+    steps = 0
+    worst = 0.0
+    started = time.perf_counter()
+    while core.indexing:
+        step_started = time.perf_counter()
+        core.index_step(0.004)
+        worst = max(worst, time.perf_counter() - step_started)
+        steps += 1
+    results = {'tracks': tracks, 'build_ms': (time.perf_counter() - started) * 1000.0, 'build_steps': steps,
+               'build_worst_step_ms': worst * 1000.0, 'queries': {}}
+    for query in SEARCH_QUERIES:
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            found = core.search(query, 200)
+            samples.append((time.perf_counter() - started) * 1000.0)
+        results['queries'][query] = {'matches': len(found), 'mean_ms': sum(samples) / len(samples),
+                                     'p95_ms': _percentile(samples, 0.95)}
+    return results
+
+
+DECO_SPRITES = (
+    ('sakuratree.gif', (120, 150)),
+    ('cutehouse.png', (90, 80)),
+    ('sakurabranch.png', (110, 60)),
+    ('pinkstarcloud.png', (70, 40)),
+    ('bunnylay.png', (40, 28)),
+    ('miffyloaf.png', (36, 30)),
+    ('miffyicon.png', (30, 34))
+)
+SUITE_TOLERANCE = 0.25
+# Differences below this are timer noise on the microsecond-scale cached paths, whatever the ratio says.
+SUITE_NOISE_MS = 0.05
+
+
+def _median_ms(action, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        action()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return _percentile(samples, 0.5)
+
+
+def write_deco_folder(folder, seed=0):
+    rng = random.Random(seed)
+    for filename, size in DECO_SPRITES:
+        img = Image.new('RGBA', size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+            x1, y1 = rng.randrange(x0, size[0] + 1), rng.randrange(y0, size[1] + 1)
+            draw.ellipse([x0, y0, x1, y1], fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256), 255))
+        img.save(Path(folder) / filename)
+
+
+def write_music_folder(folder, count):
+    folder = Path(folder)
+    for number in range(count):
+        (folder / f'track-{number:06d}.mp3').write_bytes(b'')
+
+
+def _suite_rendering(results, repeats):
+    size = rei.CANVAS_SIZE
+
+    def build_base():
+        rei._gradient_cache.clear()
+        rei.SakuraBackground(size)
+    results['background.build_base_ms'] = _median_ms(build_base, repeats)
+
+    for name, factory in (('dict', lambda: rei.SakuraPetalField(size, 250)),
+                          ('numpy', lambda: rei.SakuraPetalArrays(size, 250, seed=0))):
+        if name == 'numpy' and rei.np is None:
+            continue
+        random.seed(0)
+        field = factory()
+        field.step(1 / 30.0)
+
+        def petal_frame():
+            field.step(1 / 30.0)
+            field.render()
+        results[f'petals.{name}.frame_ms'] = _median_ms(petal_frame, repeats * 4)
+
+    grass = rei.GrassField(size[0], 60)
+    moments = iter(range(10 ** 9))
+    results['grass.render_frame_ms'] = _median_ms(
+        lambda: grass._render_frame(next(moments) * grass.period / grass.frame_count), repeats)
+    for slot in range(grass.frame_count):
+        grass.generate_frame(slot * grass.period / grass.frame_count)
+    results['grass.generate_frame_ms'] = _median_ms(lambda: grass.generate_frame(time.perf_counter()), repeats * 4)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        write_deco_folder(scratch)
+        random.seed(0)
+        deco = rei.DecoManager(scratch, size, rei.GRASS_HEIGHT)
+        results['deco.first_render_ms'] = _median_ms(lambda: (deco.invalidate(), deco.render(0.0)), repeats)
+        clock = iter(range(10 ** 9))
+        results['deco.render_ms'] = _median_ms(lambda: deco.render(next(clock) / 30.0), repeats * 4)
+
+
+def _suite_scan(results, sizes):
+    with tempfile.TemporaryDirectory() as scratch:
+        for count in sizes:
+            folder = Path(scratch) / f'music-{count}'
+            folder.mkdir()
+            write_music_folder(folder, count)
+            core = rei.PlayerCore(audio=rei.StubAudio(), library=rei.LibraryIndex(Path(scratch) / f'library-{count}.sqlite3'))
+            started = time.perf_counter()
+            core.scan(folder)
+            results[f'scan.{count}.cold_ms'] = (time.perf_counter() - started) * 1000.0
+            started = time.perf_counter()
+            core.scan(folder)
+            results[f'scan.{count}.warm_ms'] = (time.perf_counter() - started) * 1000.0
+            core.close()
+
+
+def _suite_probe(results, files, frames):
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = []
+        for number in range(files):
+            path = Path(scratch) / f'probe-{number}.mp3'
+            write_synthetic_mp3(path, frames=frames, seed=number, xing=number % 2 == 0)
+            paths.append(str(path))
+        rei.probe_track(paths[0])
+        started = time.perf_counter()
+        for path in paths:
+            rei.probe_track(path)
+        results['probe.per_file_ms'] = (time.perf_counter() - started) * 1000.0 / files
+
+
+def run_suite(scan_sizes=(1000, 10000, 100000), repeats=30, probe_files=40, probe_frames=4000):
+    results = {}
+    _suite_rendering(results, repeats)
+    _suite_scan(results, scan_sizes)
+    _suite_probe(results, probe_files, probe_frames)
+    return {
+        'meta': {
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'numpy': getattr(rei.np, '__version__', None),
+            'scan_sizes': list(scan_sizes),
+            'repeats': repeats
+        },
+        'results': results
+    }
+
+
+def compare_suite(current, baseline, tolerance=SUITE_TOLERANCE):
+    rows = []
+    for name, value in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        ratio = value / before if before else None
+        rows.append({
+            'name': name,
+            'baseline_ms': before,
+            'current_ms': value,
+            'ratio': ratio,
+            'regressed': ratio is not None and ratio > 1.0 + tolerance and value - before > SUITE_NOISE_MS
+        })
+    return rows
+
+
+def _seek_corpus(args, scratch):
+    if args.folder:
+        return sorted(Path(args.folder).glob('*.mp3'))
+    return [
+        write_synthetic_mp3(Path(scratch) / f'vbr{number:03d}.mp3', frames=args.frames, seed=number)
+        for number in range(args.files)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="REI Music Player benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+    seek = commands.add_parser('seek', help="seek latency and landing error: frame index vs Xing TOC vs CBR estimate")
+    seek.add_argument('folder', nargs='?', help="folder of MP3s to use (default: generated VBR files)")
+    seek.add_argument('--files', type=int, default=8, help="number of generated files")
+    seek.add_argument('--frames', type=int, default=12000, help="frames per generated file (~38 per second)")
+    seek.add_argument('--samples', type=int, default=100, help="random seek targets per file")
+    seek.add_argument('--json', action='store_true', help="print results as JSON")
+    petals = commands.add_parser('petals', help="SakuraPetalField (dicts) vs SakuraPetalArrays (NumPy) step+render")
+    petals.add_argument('--counts', type=int, nargs='+', default=[28, 250, 1000, 2500])
+    petals.add_argument('--frames', type=int, default=60)
+    petals.add_argument('--json', action='store_true', help="print results as JSON")
+    gradient = commands.add_parser('gradient', help="SakuraBackground gradient: per-row draw.line vs vectorised + LRU cache")
+    gradient.add_argument('--repeats', type=int, default=50)
+    gradient.add_argument('--json', action='store_true', help="print results as JSON")
+    assets = commands.add_parser('assets', help="UI sprites: open+thumbnail each PNG vs the prebaked atlas")
+    assets.add_argument('--repeats', type=int, default=20)
+    assets.add_argument('--json', action='store_true', help="print results as JSON")
+    core = commands.add_parser('core', help="headless PlayerCore on a stub mixer: big playlist, rapid next/prev/seek/tick")
+    core.add_argument('--tracks', type=int, default=100000)
+    core.add_argument('--commands', type=int, default=5000, help="commands per operation")
+    core.add_argument('--json', action='store_true', help="print results as JSON")
+    playlist = commands.add_parser('playlist', help="sorted playlist: list of Path objects vs the interned PlaylistStore")
+    playlist.add_argument('--tracks', type=int, default=1000000)
+    playlist.add_argument('--json', action='store_true', help="print results as JSON")
+    queue = commands.add_parser('queue', help="PlayQueue on a big playlist: lazy shuffle, up-next, history vs a full reshuffle")
+    queue.add_argument('--tracks', type=int, default=1000000)
+    queue.add_argument('--operations', type=int, default=20000, help="operations per measurement")
+    queue.add_argument('--json', action='store_true', help="print results as JSON")
+    waveform = commands.add_parser('waveform', help="waveform peaks: process-pool throughput and per-width resampling")
+    waveform.add_argument('--files', type=int, default=8)
+    waveform.add_argument('--frames', type=int, default=7000, help="MP3 frames per generated file (~38 per second)")
+    waveform.add_argument('--workers', type=int, default=None, help="processes (default: half the cores, at most 4)")
+    waveform.add_argument('--json', action='store_true', help="print results as JSON")
+    loudness = commands.add_parser('loudness', help="loudness normalization: gated R128 analysis and pool throughput")
+    loudness.add_argument('folder', nargs='?', help="folder of MP3s to analyse (default: generated files)")
+    loudness.add_argument('--files', type=int, default=8)
+    loudness.add_argument('--frames', type=int, default=7000, help="MP3 frames per generated file (~38 per second)")
+    loudness.add_argument('--workers', type=int, default=None, help="processes (default: half the cores, at most 4)")
+    loudness.add_argument('--json', action='store_true', help="print results as JSON")
+    search = commands.add_parser('search', help="playlist search index: chunked build and per-query latency")
+    search.add_argument('--tracks', type=int, default=100000)
+    search.add_argument('--repeats', type=int, default=20)
+    search.add_argument('--json', action='store_true', help="print results as JSON")
+    suite = commands.add_parser('suite', help="rendering, library scan and probe timings as JSON, optionally checked against a baseline")
+    suite.add_argument('--quick', action='store_true', help="scan 1k and 10k files instead of 1k, 10k and 100k")
+    suite.add_argument('--repeats', type=int, default=30)
+    suite.add_argument('--save', metavar='PATH', help="write the results JSON to PATH (e.g. to use as a baseline later)")
+    suite.add_argument('--baseline', metavar='PATH', help="compare against an earlier --save; exit 1 on regressions")
+    suite.add_argument('--tolerance', type=float, default=SUITE_TOLERANCE, help="allowed slowdown before flagging (0.25 = 25%%)")
+    suite.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == 'seek':
+        with tempfile.TemporaryDirectory() as scratch:
+            results = bench_seek(_seek_corpus(args, scratch), samples=args.samples)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['files']} files, {results['samples_per_file']} seeks each, "
+              f"index build {results['index_build_mean_ms']:.1f} ms/file")
+        print(f"{'method':<8}{'err mean':>10}{'err p95':>10}{'err max':>10}{'lat mean':>10}{'lat p95':>10}   (ms)")
+        for method in ('index', 'toc', 'cbr'):
+            row = results[method]
+            print(f"{method:<8}{row['error_mean_ms']:>10.1f}{row['error_p95_ms']:>10.1f}{row['error_max_ms']:>10.1f}"
+                  f"{row['latency_mean_ms']:>10.3f}{row['latency_p95_ms']:>10.3f}")
+
+    if args.command == 'petals':
+        results = bench_petals(args.counts, args.frames)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{'petals':>7}{'dict ms':>10}{'numpy ms':>10}{'dict p/ms':>11}{'numpy p/ms':>12}   (33 ms frame budget)")
+        for row in results:
+            numpy_row = row.get('numpy', {'frame_ms': float('nan'), 'petals_per_ms': float('nan')})
+            print(f"{row['petals']:>7}{row['dict']['frame_ms']:>10.2f}{numpy_row['frame_ms']:>10.2f}"
+                  f"{row['dict']['petals_per_ms']:>11.1f}{numpy_row['petals_per_ms']:>12.1f}")
+
+    if args.command == 'gradient':
+        results = bench_gradient(repeats=args.repeats)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{'size':>11}{'rows ms':>10}{'vector ms':>11}{'cached ms':>11}  identical")
+        for row in results:
+            size = 'x'.join(str(v) for v in row['size'])
+            print(f"{size:>11}{row['rows_ms']:>10.3f}{row['vectorized_ms']:>11.3f}{row['cached_ms']:>11.4f}  {row['identical']}")
+
+    if args.command == 'assets':
+        results = bench_assets(repeats=args.repeats)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['sprites']} sprites: direct {results['direct_ms']:.2f} ms, "
+              f"atlas build {results['atlas_build_ms']:.2f} ms, atlas cached {results['atlas_cached_ms']:.2f} ms, "
+              f"identical {results['identical']}")
+
+    if args.command == 'core':
+        results = bench_core(args.tracks, args.commands)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['tracks']} tracks loaded in {results['set_tracks_ms']:.1f} ms, "
+              f"{results['commands']} commands per operation")
+        print(f"{'op':<6}{'mean us':>10}{'p99 us':>10}")
+        for name in ('next', 'prev', 'seek', 'tick'):
+            print(f"{name:<6}{results[name]['mean_us']:>10.1f}{results[name]['p99_us']:>10.1f}")
+
+    if args.command == 'playlist':
+        results = bench_playlist(args.tracks)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['tracks']} tracks")
+        print(f"{'layout':<8}{'build ms':>10}{'MB':>10}{'B/track':>10}")
+        for name in ('paths', 'store'):
+            row = results[name]
+            print(f"{name:<8}{row['build_ms']:>10.0f}{row['bytes'] / 1e6:>10.1f}{row['bytes_per_track']:>10.0f}")
+        report = results['store']['report']
+        print(f"store report: {report['bytes'] / 1e6:.1f} MB over {report['directories']} directories, "
+              f"locate {results['store']['locate_mean_us']:.1f} us")
+
+    if args.command == 'queue':
+        results = bench_queue(args.tracks, args.operations)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['tracks']} tracks, {results['operations']} operations each; "
+              f"a full reshuffle takes {results['full_shuffle_ms']:.0f} ms")
+        print(f"{'op':<20}{'mean us':>10}{'p99 us':>10}")
+        for name in ('order_next', 'shuffle_on', 'shuffle_next', 'shuffle_peek_auto', 'prev', 'next_after_prev',
+                     'enqueue', 'upnext_next'):
+            print(f"{name:<20}{results[name]['mean_us']:>10.2f}{results[name]['p99_us']:>10.2f}")
+        print(f"shuffle slots held: {results['shuffle_slots_held']}")
+
+    if args.command == 'waveform':
+        results = bench_waveform(args.files, args.frames, args.workers)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['computed']}/{results['files']} files on {results['processes']} processes: "
+              f"{results['tracks_per_second']:.1f} tracks/s (pool start + first file {results['pool_start_ms']:.0f} ms), "
+              f"{results['peaks_bytes']} bytes each")
+        for width, ms in results['columns_ms'].items():
+            print(f"  redraw at {width:>4} px: {ms:.3f} ms")
+
+    if args.command == 'loudness':
+        results = bench_loudness(args.files, args.frames, args.workers, args.folder)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        analysis = results['analysis']
+        print(f"analysis of a {analysis['track_seconds']} s stereo track: {analysis['ms_per_track']:.0f} ms "
+              f"({analysis['tracks_per_min_per_core']:.0f} tracks/min/core), -20 dBFS tone reads "
+              f"{analysis['tone_lufs']:.2f} LUFS")
+        print(f"{results['files']} files on {results['processes']} processes "
+              f"(pool start + first file {results['pool_start_ms']:.0f} ms)")
+        for name in ('scan', 'tags'):
+            row = results[name]
+            print(f"  {name:<5}{row['computed']:>4} done, {row['tracks_per_min_per_core']:>8.0f} tracks/min/core  "
+                  f"source {'/'.join(row['sources'])}")
+
+    if args.command == 'search':
+        results = bench_search(args.tracks, args.repeats)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        print(f"{results['tracks']} tracks indexed in {results['build_ms']:.0f} ms over {results['build_steps']} steps "
+              f"(worst step {results['build_worst_step_ms']:.1f} ms)")
+        print(f"{'query':<24}{'matches':>8}{'mean ms':>10}{'p95 ms':>10}")
+        for query, row in results['queries'].items():
+            print(f"{query!r:<24}{row['matches']:>8}{row['mean_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+    if args.command == 'suite':
+        sizes = (1000, 10000) if args.quick else (1000, 10000, 100000)
+        results = run_suite(scan_sizes=sizes, repeats=args.repeats)
+        if args.save:
+            Path(args.save).write_text(json.dumps(results, indent=2))
+        rows = None
+        if args.baseline:
+            rows = compare_suite(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+            results['comparison'] = rows
+        if args.json:
+            print(json.dumps(results, indent=2))
+        elif rows is None:
+            for name, value in results['results'].items():
+                print(f"{name:<28}{value:>12.3f} ms")
+        else:
+            print(f"{'benchmark':<28}{'baseline':>12}{'current':>12}{'ratio':>8}")
+            for row in rows:
+                before = f"{row['baseline_ms']:.3f}" if row['baseline_ms'] is not None else '-'
+                ratio = f"{row['ratio']:.2f}" if row['ratio'] is not None else '-'
+                flag = '  REGRESSED' if row['regressed'] else ''
+                print(f"{row['name']:<28}{before:>12}{row['current_ms']:>12.3f}{ratio:>8}{flag}")
+        if rows is not None and any(row['regressed'] for row in rows):
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())